@@ -1,9 +1,23 @@
+import csv
+import io
+import os
 import sqlite3
-from flask import Flask, redirect, render_template, request, session, url_for
-from flask_session import Session
-from werkzeug.security import check_password_hash, generate_password_hash
-
-from helpers import login_required
+from flask import Flask, abort, jsonify, redirect, render_template, request, session, stream_with_context, url_for
+
+from assets import init_assets
+from autocomplete import FIELDS, get_autocomplete, init_autocomplete
+from benchmarks import init_benchmarks
+from cache import cached, conditional, data_version, get_cache, init_cache
+from database import DEFAULT_PRAGMAS, get_db, get_pool, init_db
+from helpers import cache_control, login_required
+from listing import paginate, spec_for
+from migrations import init_migrations
+from passwords import HasherBusy, get_hasher, hash_password, init_passwords, verify_password
+from ratelimit import RateLimited, get_limiter, init_ratelimit
+from search import find_entries
+from sessions import get_sweeper, init_sessions
+from topics import init_topics, link_topics, skill_counts
+from transfer import FORMATS, MAX_ERRORS, export_entries, import_entries, init_transfer, read_entries
 
 # Configure application
 app = Flask(__name__)
@@ -11,161 +25,244 @@ app = Flask(__name__)
 # Ensure templates are auto-reloaded
 app.config["TEMPLATES_AUTO_RELOAD"] = True
 
-# Configure session to use filesystem (instead of signed cookies)
+# Configure session to be stored in courses.db (or "signed" to keep a lone
+# user id in a signed cookie, signed with SESSION_SIGNING_KEYS, newest last)
+app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY")
+app.config["SESSION_SIGNING_KEYS"] = []
 app.config["SESSION_PERMANENT"] = False
-app.config["SESSION_TYPE"] = "filesystem"
-Session(app)
-
-# Connect to SQLite database
-db_path = "/home/coreyrichardson/mysite/courses.db"
-conn = sqlite3.connect(db_path, check_same_thread=False)
-db = conn.cursor()
-
-# CREATE TABLE users (id INTEGER, username TEXT NOT NULL UNIQUE, hash TEXT NOT NULL, PRIMARY KEY(id));
-# CREATE TABLE courses (id INTEGER, user_id INTEGER NOT NULL, name TEXT NOT NULL UNIQUE, url TEXT, topics TEXT NOT NULL, desc TEXT NOT NULL, provider TEXT NOT NULL, is_complete BOOL NOT NULL, is_course BOOL NOT NULL, PRIMARY KEY(id));
+app.config["SESSION_TYPE"] = "sqlite"
+app.config["SESSION_SWEEP_INTERVAL"] = 15 * 60 # seconds, 0 to only sweep from `flask sessions sweep`
+app.config["SESSION_SWEEP_BATCH"] = 500
+init_sessions(app)
+
+# Number of entries per page on the course and module listings
+app.config["PAGE_SIZE"] = 25
+
+# Most entries one bulk update or drop may act on (and /bulk lists)
+app.config["BULK_MAX_IDS"] = 500
+
+# Cache each user's listings in memory until their data changes, and let
+# browsers revalidate them by ETag (salted with the templates unless set)
+app.config["LISTING_CACHE_ENTRIES"] = 1024
+app.config["LISTING_CACHE_BYTES"] = 16 * 1024 * 1024
+app.config["LISTING_ETAG_SALT"] = None
+init_cache(app)
+
+# Suggest topics and providers as they're typed, from the user's own and
+# from those shared by at least AUTOCOMPLETE_GLOBAL_MIN_USERS users
+app.config["AUTOCOMPLETE_USERS"] = 1000
+app.config["AUTOCOMPLETE_GLOBAL_TTL"] = 5 * 60 # seconds
+app.config["AUTOCOMPLETE_GLOBAL_MIN_USERS"] = 2
+init_autocomplete(app)
+
+# Configure SQLite database, checked out from a pool once per request
+app.config["DATABASE"] = os.environ.get("COURSES_DATABASE", "/home/coreyrichardson/mysite/courses.db")
+app.config["DATABASE_POOL_SIZE"] = 8
+app.config["DATABASE_POOL_TIMEOUT"] = 10
+app.config["DATABASE_PRAGMAS"] = dict(DEFAULT_PRAGMAS) # WAL, see `flask bench pragmas`
+init_db(app)
+
+# Bring the schema up to date before serving any requests, except when
+# loaded for `flask db` (set MIGRATE_ON_STARTUP=0 to only migrate from there)
+app.config["MIGRATE_ON_STARTUP"] = os.environ.get("MIGRATE_ON_STARTUP", "1").lower() not in ("0", "false", "no")
+init_migrations(app)
+
+# Hash passwords in worker processes, answering 503 once too many are waiting
+app.config["PASSWORD_POOL_SIZE"] = 2
+app.config["PASSWORD_POOL_QUEUE"] = 8
+app.config["PASSWORD_POOL_TIMEOUT"] = 10
+app.config["PASSWORD_RETRY_AFTER"] = 5 # seconds
+app.config["PASSWORD_HASH_METHOD"] = "scrypt:32768:8:1" # see `flask bench kdf`, older hashes upgrade on login
+init_passwords(app)
+
+# Limit login attempts per username and per address, before any hashing
+app.config["LOGIN_LIMIT_BURST"] = 10
+app.config["LOGIN_LIMIT_PER_MINUTE"] = 5
+app.config["LOGIN_LIMIT_MAX_KEYS"] = 10000
+app.config["LOGIN_LIMIT_STORE"] = "memory" # or "sqlite" to share limits between worker processes
+init_ratelimit(app)
+
+# Let browsers keep static files for an hour, revalidating them after that,
+# and fingerprinted copies (see `flask assets build`) for good
+app.config["SEND_FILE_MAX_AGE_DEFAULT"] = 60 * 60
+init_assets(app)
+
+# Expose internal counters at /stats (off in production)
+app.config["STATS_ENABLED"] = False
+
+# Largest upload accepted, which bounds an import to roughly 100k entries
+app.config["MAX_CONTENT_LENGTH"] = 32 * 1024 * 1024
+
+# Register `flask bench`, `flask skills` and `flask entries` commands
+init_benchmarks(app)
+init_topics(app)
+init_transfer(app)
+
+# Schema is defined by the numbered migrations in migrations.py
 
 @app.after_request
 def after_request(response):
-    """Ensure responses aren't cached"""
-    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    response.headers["Expires"] = 0
-    response.headers["Pragma"] = "no-cache"
+    """Ensure responses aren't cached, unless their route says otherwise"""
+    if "Cache-Control" not in response.headers:
+        response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
+        response.headers["Expires"] = 0
+        response.headers["Pragma"] = "no-cache"
+    return response
+
+@app.errorhandler(HasherBusy)
+def hasher_busy(error):
+    """Ask the client to come back once the password hashing pool has caught up"""
+    response = app.make_response((
+        render_template("failure.html", ERR_MSG="The server is busy, please try again shortly."),
+        503,
+    ))
+    response.headers["Retry-After"] = app.config["PASSWORD_RETRY_AFTER"]
+    return response
+
+@app.errorhandler(RateLimited)
+def rate_limited(error):
+    """Turn away login attempts over the limit until their bucket refills"""
+    response = app.make_response((
+        render_template("failure.html", ERR_MSG="Too many login attempts, please try again later."),
+        429,
+    ))
+    response.headers["Retry-After"] = error.retry_after
     return response
 
 @app.route("/", methods=["GET", "POST"])
 @login_required
+@conditional
 def index():
     """Display all courses the user has added to the database."""
-    if request.method == "POST" and request.form.get("sort_index"):
-        sort_index = request.form.get("sort_index")
-        match sort_index:
-            case "provider":
-                courses = db.execute(
-                    "SELECT * FROM courses WHERE user_id = ? AND is_course = true ORDER BY provider, name",
-                    (session["user_id"],)
-                )
-            case "completed":
-                courses = db.execute(
-                    "SELECT * FROM courses WHERE user_id = ? AND is_course = true ORDER BY is_complete DESC, name",
-                    (session["user_id"],)
-                )
-            case "inProgress":
-                courses = db.execute(
-                    "SELECT * FROM courses WHERE user_id = ? AND is_course = true ORDER BY CASE is_complete WHEN 1 THEN 1 WHEN 2 THEN 2 WHEN 0 THEN 3 END, name",
-                    (session["user_id"],)
-                )
-            case "incomplete":
-                courses = db.execute(
-                    "SELECT * FROM courses WHERE user_id = ? AND is_course = true ORDER BY is_complete ASC, name",
-                    (session["user_id"],)
-                )
-            case "onlyCompleted":
-                courses = db.execute(
-                    "SELECT * FROM courses WHERE user_id = ? AND is_course = true AND is_complete = 2 ORDER BY name",
-                    (session["user_id"],)
-                )
-            case "hideCompleted":
-                courses = db.execute(
-                    "SELECT * FROM courses WHERE user_id = ? AND is_course = true AND is_complete != 2 ORDER BY is_complete DESC, name",
-                    (session["user_id"],)
-                )
-            case _: # name or anything else
-                courses = db.execute(
-                    "SELECT * FROM courses WHERE user_id = ? AND is_course = true ORDER BY name",
-                    (session["user_id"],)
-                )
-
-    else:
-        courses = db.execute(
-            "SELECT * FROM courses WHERE user_id = ? AND is_course = true ORDER BY name",
-            (session["user_id"],)
-        )
+    db = get_db()
 
-    courses = courses.fetchall()
+    sort_index = request.values.get("sort_index", "name")
+    spec = spec_for(sort_index, is_course=True, limit=app.config["PAGE_SIZE"])
+    after, before = request.args.get("after"), request.args.get("before")
+    page = cached("listing", (spec, after, before), lambda: paginate(db, spec, session["user_id"], after, before))
 
-    if len(courses) == 0:
+    if len(page.rows) == 0:
         return render_template("empty.html", type="courses", action="display")
 
-    return render_template("index.html", courses=courses, type="Courses")
+    return render_template("index.html", courses=page.rows, page=page, sort_index=sort_index, type="Courses")
 
 @app.route("/modules", methods=["GET", "POST"])
 @login_required
+@conditional
 def modules():
     """Display modules the user has added to the database."""
-    if request.method == "POST" and request.form.get("sort_index"):
-        sort_index = request.form.get("sort_index")
-        match sort_index:
-            case "provider":
-                modules = db.execute(
-                    "SELECT * FROM courses WHERE user_id = ? AND is_course = false ORDER BY provider, name",
-                    (session["user_id"],)
-                )
-            case "completed":
-                modules = db.execute(
-                    "SELECT * FROM courses WHERE user_id = ? AND is_course = false ORDER BY is_complete DESC, name",
-                    (session["user_id"],)
-                )
-            case "inProgress":
-                modules = db.execute(
-                    "SELECT * FROM courses WHERE user_id = ? AND is_course = false ORDER BY CASE is_complete WHEN 1 THEN 1 WHEN 2 THEN 2 WHEN 0 THEN 3 END, name",
-                    (session["user_id"],)
-                )
-            case "incomplete":
-                modules = db.execute(
-                    "SELECT * FROM courses WHERE user_id = ? AND is_course = false ORDER BY is_complete ASC, name",
-                    (session["user_id"],)
-                )
-            case "onlyCompleted":
-                modules = db.execute(
-                    "SELECT * FROM courses WHERE user_id = ? AND is_course = false AND is_complete = 2 ORDER BY name",
-                    (session["user_id"],)
-                )
-            case "hideCompleted":
-                modules = db.execute(
-                    "SELECT * FROM courses WHERE user_id = ? AND is_course = false AND is_complete != 2 ORDER BY name",
-                    (session["user_id"],)
-                )
-            case _: # name or anything else
-                modules = db.execute(
-                    "SELECT * FROM courses WHERE user_id = ? AND is_course = false ORDER BY name",
-                    (session["user_id"],)
-                )
+    db = get_db()
 
-    else:
-        modules = db.execute(
-            "SELECT * FROM courses WHERE user_id = ? AND is_course = false ORDER BY name",
-            (session["user_id"],)
-        )
-
-    modules = modules.fetchall()
+    sort_index = request.values.get("sort_index", "name")
+    spec = spec_for(sort_index, is_course=False, limit=app.config["PAGE_SIZE"])
+    after, before = request.args.get("after"), request.args.get("before")
+    page = cached("listing", (spec, after, before), lambda: paginate(db, spec, session["user_id"], after, before))
 
-    if len(modules) == 0:
+    if len(page.rows) == 0:
         return render_template("empty.html", type="modules", action="display")
 
-    return render_template("index.html", courses=modules, type="Modules")
+    return render_template("index.html", courses=page.rows, page=page, sort_index=sort_index, type="Modules")
+
+@app.route("/search")
+@login_required
+def search():
+    """Find the user's courses and modules by words in any of their text fields."""
+    query = request.args.get("q", "").strip()
+    results = find_entries(get_db(), session["user_id"], query) if query else []
+    return render_template("search.html", query=query, results=results)
+
+@app.route("/autocomplete")
+@login_required
+def autocomplete():
+    """Suggest values for the topics or provider field starting with `q`."""
+    field = request.args.get("field")
+    if field not in FIELDS:
+        abort(400)
+    prefix = request.args.get("q", "").strip()
+    suggestions = get_autocomplete().complete(get_db(), session["user_id"], field, prefix) if prefix else []
+    return jsonify(suggestions=suggestions)
+
+@app.route("/export")
+@login_required
+def export():
+    """Download all of the user's courses and modules as CSV, JSON or NDJSON."""
+    format = request.args.get("format", "csv")
+    if format not in FORMATS:
+        return redirect(url_for("failure", ERR_MSG="Export format must be csv, json or ndjson."))
+
+    mimetype, extension = FORMATS[format]
+    # Keeps the request's database connection open while the rows are sent
+    chunks = export_entries(get_db(), session["user_id"], format)
+    response = app.response_class(stream_with_context(chunks), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename=courses.{extension}"
+    return response
+
+@app.route("/import", methods=["GET", "POST"])
+@login_required
+def import_():
+    """Add courses and modules in bulk from a CSV, JSON or NDJSON file."""
+    if request.method == "POST":
+        upload = request.files.get("file")
+        if not upload or not upload.filename:
+            return redirect(url_for("failure", ERR_MSG="Choose a file to import."))
+        format = request.form.get("format") or upload.filename.rsplit(".", 1)[-1].lower()
+        if format not in FORMATS:
+            return redirect(url_for("failure", ERR_MSG="Import format must be csv, json or ndjson."))
+
+        stream = io.TextIOWrapper(upload.stream, encoding="utf-8-sig", newline="")
+        try:
+            imported, errors, seconds = import_entries(get_db(), session["user_id"], read_entries(stream, format))
+        except (ValueError, csv.Error) as error:
+            return redirect(url_for("failure", ERR_MSG=f"Couldn't read the file: {error}"))
+
+        return render_template(
+            "import.html", imported=imported, errors=errors, seconds=seconds, stopped=len(errors) >= MAX_ERRORS
+        )
+
+    return render_template("import.html")
 
 @app.route("/failure")
 def failure():
     error_message = request.args.get("ERR_MSG", "Undefined Error.")
     return render_template("failure.html", ERR_MSG=error_message)
 
+@app.route("/stats")
+@login_required
+def stats():
+    """Report internal counters used to size the app under load."""
+    if not app.config["STATS_ENABLED"]:
+        abort(404)
+    return jsonify(
+        db_pool=get_pool().stats(),
+        listing_cache=get_cache().stats(),
+        passwords=get_hasher().stats(),
+        autocomplete=get_autocomplete().stats(),
+        login_limiter=get_limiter().stats(),
+        sessions=get_sweeper().stats(),
+    )
+
 @app.route("/login", methods=["GET", "POST"])
+@cache_control(private=True, max_age=10 * 60)
 def login():
     # Forget an user_id
     session.clear()
 
     if request.method == "POST":
+        db = get_db()
+
         if not request.form.get("username"):
              return redirect(url_for("failure", ERR_MSG="Username field was left empty."))
         if not request.form.get("password"):
             return redirect(url_for("failure", ERR_MSG="Password field was left empty."))
 
+        get_limiter().check(request.form.get("username"), request.remote_addr)
+
         users = db.execute(
             "SELECT * FROM users WHERE username = ?",
             (request.form.get("username"),)
         ).fetchall()
 
-        if len(users) != 1 or not check_password_hash(users[0][2], request.form.get("password")):
+        if len(users) != 1 or not verify_password(users[0][2], request.form.get("password"), users[0][0]):
             return redirect(url_for("failure", ERR_MSG="Username or password invalid!"))
 
         session["user_id"] = users[0][0]
@@ -182,8 +279,10 @@ def logout():
     return redirect("/login")
 
 @app.route("/register", methods=["GET", "POST"])
+@cache_control(private=True, max_age=10 * 60)
 def register():
     """Register user"""
+    db = get_db()
 
     if request.method == "POST":
         username = request.form.get("username")
@@ -200,7 +299,7 @@ def register():
         if password != confirm:
             return redirect(url_for("failure", ERR_MSG="Passwords didn't match."))
 
-        password = generate_password_hash(password)
+        password = hash_password(password)
 
         try:
             db.execute(
@@ -208,7 +307,7 @@ def register():
                 (username, password,)
             )
 
-            conn.commit()
+            db.commit()
         except ValueError:
             return redirect("failure", "Username already exists!")
 
@@ -218,7 +317,10 @@ def register():
 
 @app.route("/add", methods=["GET", "POST"])
 @login_required
+@cache_control(private=True, max_age=10 * 60)
 def add():
+    db = get_db()
+
     course_name = request.form.get("course_name")
     course_url = request.form.get("course_url") # OPTNL FIELD CAN BE MISSED FROM REQUEST!
     course_topics = request.form.get("topics")
@@ -238,29 +340,26 @@ def add():
             return redirect(url_for("failure", ERR_MSG="Course provider field was left empty."))
         if not course_completed:
             return redirect(url_for("failure", ERR_MSG="Course completion status field was left empty."))
+        if course_completed not in ("0", "1", "2"):
+            return redirect(url_for("failure", ERR_MSG="Course completion status was invalid."))
         if not course_type:
             return redirect(url_for("failure", ERR_MSG="Course type field was left empty."))
 
         course_type = True if course_type == "true" else False
 
-        if not course_url:
-            db.execute(
-                "INSERT INTO courses \
-                (user_id, name, topics, desc, provider, is_complete, is_course) \
-                VALUES (?, ?, ?, ?, ?, ?, ?)",
-                (session["user_id"],
-                course_name, course_topics, course_desc, course_provider, course_completed, course_type,)
-            )
-        else:
-            db.execute(
-                "INSERT INTO courses \
-                (user_id, name, url, topics, desc, provider, is_complete, is_course) \
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                (session["user_id"],
-                course_name, course_url, course_topics, course_desc, course_provider, course_completed, course_type,)
-            )
+        course = db.execute(
+            "INSERT INTO courses \
+            (user_id, name, url, topics, desc, provider, is_complete, is_course) \
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (session["user_id"],
+            course_name, course_url or None, course_topics, course_desc, course_provider, course_completed, course_type,)
+        )
+        link_topics(db, [(course.lastrowid, course_topics)])
 
-        conn.commit()
+        db.commit()
+        get_autocomplete().record(
+            session["user_id"], data_version(db, session["user_id"]), added=[(course_topics, course_provider)]
+        )
 
         if course_type: # course
             return redirect("/")
@@ -273,87 +372,76 @@ def add():
 @app.route("/update", methods=["GET", "POST"])
 @login_required
 def update():
+    db = get_db()
 
     if request.method == "POST":
-        # Course to update (reqd.)
-        current_course_name = request.form.get("current_course_name")
+        # Entry to update (reqd.)
+        course_id = request.form.get("course_id")
         # Fields to update (optnl.)
-        course_name = request.form.get("name")
-        course_url = request.form.get("url")
-        course_desc = request.form.get("desc")
-        course_topics = request.form.get("topics")
-        course_provider = request.form.get("provider")
-        course_completed = request.form.get("completion")
-        course_type = request.form.get("type")
-
-        if not current_course_name:
+        fields = {
+            "name": request.form.get("name"),
+            "url": request.form.get("url"),
+            "desc": request.form.get("desc"),
+            "topics": request.form.get("topics"),
+            "provider": request.form.get("provider"),
+            "is_complete": request.form.get("completion"),
+            "is_course": request.form.get("type"),
+        }
+
+        if not course_id:
             return redirect(url_for("failure", ERR_MSG="Course name field was left empty."))
-        
-        if course_url:
-            db.execute(
-                "UPDATE courses \
-                SET url = ? \
-                WHERE name = ? AND user_id = ?",
-                (course_url, current_course_name, session["user_id"],)
-            )
-        
-        if course_desc:
-            db.execute(
-                "UPDATE courses \
-                SET desc = ? \
-                WHERE name = ? AND user_id = ?",
-                (course_desc, current_course_name, session["user_id"],)
-            )
-        
-        if course_topics:
-            db.execute(
-                "UPDATE courses \
-                SET topics = ? \
-                WHERE name = ? AND user_id = ?",
-                (course_topics, current_course_name, session["user_id"],)
-            )
-        
-        if course_provider:
-            db.execute(
-                "UPDATE courses \
-                SET provider = ? \
-                WHERE name = ? AND user_id = ?",
-                (course_provider, current_course_name, session["user_id"],)
-            )
-        
-        if course_completed:
-            db.execute(
-                "UPDATE courses \
-                SET is_complete = ? \
-                WHERE name = ? AND user_id = ?",
-                (course_completed, current_course_name, session["user_id"],)
+        if fields["is_complete"] and fields["is_complete"] not in ("0", "1", "2"):
+            return redirect(url_for("failure", ERR_MSG="Course completion status was invalid."))
+
+        if fields["is_complete"]:
+            fields["is_complete"] = int(fields["is_complete"])
+        if fields["is_course"]:
+            fields["is_course"] = 1 if fields["is_course"] == "true" else 0
+
+        current = db.execute(
+            "SELECT name, url, desc, topics, provider, is_complete, is_course FROM courses \
+            WHERE id = ? AND user_id = ?",
+            (course_id, session["user_id"],)
+        ).fetchone()
+
+        if current is None:
+            return redirect(url_for("failure", ERR_MSG="That entry doesn't exist."))
+
+        # Only supplied fields that differ from what's stored are written
+        changes = {
+            column: value
+            for (column, value), stored in zip(fields.items(), current)
+            if value not in (None, "") and value != stored
+        }
+
+        if changes:
+            try:
+                db.execute(
+                    f"UPDATE courses \
+                    SET {', '.join(f'{column} = ?' for column in changes)} \
+                    WHERE id = ? AND user_id = ?",
+                    (*changes.values(), course_id, session["user_id"],)
+                )
+            except sqlite3.IntegrityError:
+                return redirect(url_for("failure", ERR_MSG="You already have an entry with that name."))
+
+            if "topics" in changes:
+                link_topics(db, [(course_id, changes["topics"])])
+
+            db.commit()
+            get_autocomplete().record(
+                session["user_id"],
+                data_version(db, session["user_id"]),
+                removed=[(current[3], current[4])],
+                added=[(changes.get("topics", current[3]), changes.get("provider", current[4]))],
             )
 
-        if course_type:
-            course_type = True if course_type == "true" else False
-            db.execute(
-                "UPDATE courses \
-                SET is_course = ? \
-                WHERE name = ? AND user_id = ?",
-                (course_type, current_course_name, session["user_id"],)
-            )
-        
-        # Name must be changed last
-        if course_name:
-            db.execute(
-                "UPDATE courses \
-                SET name = ? \
-                WHERE name = ? AND user_id = ?",
-                (course_name, current_course_name, session["user_id"],)
-            )
-        
-        conn.commit()    
         return redirect("/")
 
-    names = db.execute(
-        "SELECT name FROM courses WHERE user_id = ? ORDER BY is_course DESC, name",
+    names = cached("update", None, lambda: db.execute(
+        "SELECT id, name FROM courses WHERE user_id = ? ORDER BY is_course DESC, name",
         (session["user_id"],)
-    ).fetchall()
+    ).fetchall())
     
     if len(names) == 0:
         return render_template("empty.html", type="entries", action="update")
@@ -361,40 +449,135 @@ def update():
     return render_template("update.html", names=names)
 
 
+def selected_ids():
+    """Distinct entry ids chosen in a form, or None unless there are 1 to BULK_MAX_IDS of them."""
+    try:
+        ids = {int(course_id) for course_id in request.form.getlist("course_id")}
+    except ValueError:
+        return None
+    if not 0 < len(ids) <= app.config["BULK_MAX_IDS"]:
+        return None
+    return sorted(ids)
+
+def drop_entries(db, ids):
+    """Delete the user's entries in `ids` with one statement, returning how many went."""
+    deleted = db.execute(
+        f"DELETE FROM courses \
+        WHERE user_id = ? AND id IN ({', '.join('?' * len(ids))})",
+        (session["user_id"], *ids,)
+    ).rowcount
+    db.commit()
+    return deleted
+
 @app.route("/drop", methods=["GET", "POST"])
 @login_required
 def drop():
+    db = get_db()
 
     if request.method == "POST":
-        course_name = request.form.get("course_name")
-
-        if not course_name:
-            return redirect(url_for("failure", ERR_MSG="Course name field was left empty."))
+        ids = selected_ids()
 
-        db.execute(
-            "DELETE FROM courses \
-            WHERE name = ? AND user_id = ?",
-            (course_name, session["user_id"],)
-        )
+        if ids is None:
+            return redirect(url_for("failure", ERR_MSG=f"Choose between 1 and {app.config['BULK_MAX_IDS']} entries to drop."))
 
-        conn.commit()
+        drop_entries(db, ids)
 
         return redirect("/")
 
 
-    names = db.execute(
-        "SELECT name FROM courses WHERE user_id = ? ORDER BY is_course, name",
+    names = cached("drop", None, lambda: db.execute(
+        "SELECT id, name FROM courses WHERE user_id = ? ORDER BY is_course, name",
         (session["user_id"],)
-    ).fetchall()
+    ).fetchall())
     
     if len(names) == 0:
         return render_template("empty.html", type="entries", action="drop")
 
     return render_template("drop.html", names=names)
 
+@app.route("/bulk", methods=["GET", "POST"])
+@login_required
+def bulk():
+    """Update or drop many entries at once, each as one set-based statement."""
+    db = get_db()
+
+    if request.method == "POST":
+        ids = selected_ids()
+
+        if ids is None:
+            return redirect(url_for("failure", ERR_MSG=f"Choose between 1 and {app.config['BULK_MAX_IDS']} entries."))
+
+        if request.form.get("action") == "drop":
+            drop_entries(db, ids)
+            return redirect("/bulk")
+
+        # Fields to set on every chosen entry (optnl.)
+        changes = {
+            "provider": request.form.get("provider"),
+            "is_complete": request.form.get("completion"),
+            "is_course": request.form.get("type"),
+        }
+
+        if changes["is_complete"] and changes["is_complete"] not in ("0", "1", "2"):
+            return redirect(url_for("failure", ERR_MSG="Course completion status was invalid."))
+
+        if changes["is_complete"]:
+            changes["is_complete"] = int(changes["is_complete"])
+        if changes["is_course"]:
+            changes["is_course"] = 1 if changes["is_course"] == "true" else 0
+
+        changes = {column: value for column, value in changes.items() if value not in (None, "")}
+
+        if not changes:
+            return redirect(url_for("failure", ERR_MSG="Choose a completion status, type or provider to set."))
+
+        # Entries that already have every value are left alone
+        db.execute(
+            f"UPDATE courses \
+            SET {', '.join(f'{column} = ?' for column in changes)} \
+            WHERE user_id = ? AND id IN ({', '.join('?' * len(ids))}) \
+            AND ({' OR '.join(f'{column} IS NOT ?' for column in changes)})",
+            (*changes.values(), session["user_id"], *ids, *changes.values(),)
+        )
+        db.commit()
+
+        return redirect("/bulk")
+
+    # Narrow the list by type and provider, e.g. to clear out a provider's courses
+    provider = request.args.get("provider", "")
+    entry_type = request.args.get("type", "")
+    filters = []
+    if entry_type in ("course", "module"):
+        filters.append(("is_course = ?", 1 if entry_type == "course" else 0))
+    if provider:
+        filters.append(("provider = ?", provider))
+
+    limit = app.config["BULK_MAX_IDS"]
+    entries = cached("bulk", (entry_type, provider), lambda: db.execute(
+        f"SELECT id, name, provider, is_complete, is_course FROM courses \
+        WHERE user_id = ? {''.join(f' AND {clause}' for clause, _ in filters)} \
+        ORDER BY is_course DESC, provider, name LIMIT ?",
+        (session["user_id"], *(value for _, value in filters), limit + 1,)
+    ).fetchall())
+    providers = cached("bulk_providers", None, lambda: [provider for (provider,) in db.execute(
+        "SELECT DISTINCT provider FROM courses WHERE user_id = ? ORDER BY provider",
+        (session["user_id"],)
+    )])
+
+    if len(entries) == 0 and not filters:
+        return render_template("empty.html", type="entries", action="edit")
+
+    return render_template(
+        "bulk.html",
+        entries=entries[:limit], truncated=len(entries) > limit,
+        providers=providers, provider=provider, entry_type=entry_type,
+    )
+
 @app.route("/change_password", methods=["GET", "POST"])
 @login_required
+@cache_control(private=True, max_age=10 * 60)
 def change_password():
+    db = get_db()
 
     if request.method == "POST":
         current_password = request.form.get("current_password")
@@ -413,7 +596,7 @@ def change_password():
             (session["user_id"],)
         ).fetchall()
 
-        if not check_password_hash(user[0][2], current_password):
+        if not verify_password(user[0][2], current_password):
             return redirect(url_for("failure", ERR_MSG="Password was incorrect."))
         if new_password != confirm_password:
             return redirect(url_for("failure", ERR_MSG="Passwords did not match."))
@@ -422,10 +605,10 @@ def change_password():
             "UPDATE users \
             SET hash = ? \
             WHERE id = ?",
-            (generate_password_hash(new_password), session["user_id"],)
+            (hash_password(new_password), session["user_id"],)
         )
 
-        conn.commit()
+        db.commit()
 
         return render_template("success.html")
 
@@ -433,30 +616,13 @@ def change_password():
 
 @app.route("/skills")
 @login_required
+@conditional
 def skills():
-    course_topics = db.execute(
-        "SELECT topics FROM courses \
-        WHERE user_id = ? AND is_complete = 2",
-        (session["user_id"],)
-    ).fetchall()
-    
-    if len(course_topics) == 0:
+    db = get_db()
+
+    skills = cached("skills", None, lambda: skill_counts(db, session["user_id"]))
+
+    if len(skills) == 0:
         return render_template("empty.html", type="skills", action="display")
-    
-    topics = {}
-    
-    # course_topics = [('Python, OOP',), ('CompSci, C, Python, HTML, CSS, JS, SQL',)]
-    for skill_tuple in course_topics:
-        skill_tuple_contents = skill_tuple[0]
-        skill_list = skill_tuple_contents.split(",")
-        for skill in skill_list:
-            skill = skill.strip()
-            if skill in topics:
-                topics[skill] += 1
-            else:
-                topics[skill] = 1
-                    
-    skills = sorted(topics.items(), key=lambda x: (-x[1], x[0].lower()))
 
     return render_template("skills.html", skills=skills)
-    
\ No newline at end of file
@@ -0,0 +1,410 @@
+"""
+Fingerprinted static assets.
+
+`flask assets build` copies each file in static/ to static/dist/ under a
+name carrying a hash of its contents, along with gzip (and, if the brotli
+package is installed, brotli) compressed copies, and records the names in
+static/dist/manifest.json. Templates link to files with asset_url(), which
+uses the fingerprinted name when there is one, so it can be cached for
+a year: a changed file gets a new URL. Files a build replaces are kept,
+and still served, for ASSETS_KEEP_RETIRED seconds, so pages and servers
+still linking to them don't break; later builds delete them.
+
+`flask assets bootstrap` writes static/bootstrap.min.css with only the
+Bootstrap rules that some template's classes can match. Until it has been
+run, pages fall back to Bootstrap from its CDN.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import time
+import urllib.request
+
+import click
+from flask import abort, current_app, request, send_from_directory, url_for
+from flask.cli import AppGroup
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Content-Encoding of each precompressed variant, in order of preference
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+
+# Files worth compressing; images other than icons are compressed already
+COMPRESSIBLE = {".css", ".js", ".svg", ".ico", ".json", ".txt"}
+
+ONE_YEAR = 365 * 24 * 60 * 60
+
+BOOTSTRAP_VERSION = "5.1.3"
+BOOTSTRAP_CSS_URL = f"https://cdn.jsdelivr.net/npm/bootstrap@{BOOTSTRAP_VERSION}/dist/css/bootstrap.min.css"
+BOOTSTRAP_JS_URL = f"https://cdn.jsdelivr.net/npm/bootstrap@{BOOTSTRAP_VERSION}/dist/js/bootstrap.bundle.min.js"
+
+# Classes only ever set by scripts (see static/nav.js), so no template uses them
+SAFELIST = {"show", "collapsing", "collapsed"}
+
+CLASS_ATTRIBUTE = re.compile(r'class="([^"]*)"')
+SELECTOR_CLASS = re.compile(r"\.(-?[_a-zA-Z][\w-]*)")
+NEGATION = re.compile(r":not\([^)]*\)")
+
+# At-rules holding rules of their own, which are purged in turn
+NESTING_AT_RULES = {"media", "supports", "layer", "container"}
+
+
+def dist_folder(app):
+    return os.path.join(app.static_folder, "dist")
+
+
+def fingerprint(path):
+    """Name for the file at `path` with a hash of its contents, e.g. style.3f2a9c1b0d4e.css."""
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:12]
+    stem, suffix = os.path.splitext(os.path.basename(path))
+    return f"{stem}.{digest}{suffix}"
+
+
+def _compress(path, data):
+    """Write smaller precompressed variants of `data` next to `path`."""
+    variants = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants[".br"] = brotli.compress(data, quality=11)
+
+    for extension, compressed in variants.items():
+        if len(compressed) < len(data):
+            with open(path + extension, "wb") as f:
+                f.write(compressed)
+
+
+def build(app):
+    """
+    Fingerprint and precompress everything in static/, returning the
+    manifest. Files from earlier builds are retired, not deleted.
+    """
+    source = app.static_folder
+    target = dist_folder(app)
+    previous = load_manifest(app)
+    os.makedirs(target, exist_ok=True)
+
+    manifest = {}
+    for directory, folders, files in os.walk(source):
+        if os.path.abspath(directory) == os.path.abspath(source):
+            folders[:] = [folder for folder in folders if folder != "dist"]
+        for file in sorted(files):
+            path = os.path.join(directory, file)
+            name = os.path.relpath(path, source).replace(os.sep, "/")
+            fingerprinted = fingerprint(path)
+            built = os.path.join(target, fingerprinted)
+
+            with open(path, "rb") as f:
+                data = f.read()
+            with open(built, "wb") as f:
+                f.write(data)
+            if os.path.splitext(file)[1] in COMPRESSIBLE:
+                _compress(built, data)
+            manifest[name] = fingerprinted
+
+    retired = _retire(app, set(previous.values()) - set(manifest.values()), set(manifest.values()))
+    with open(os.path.join(target, "retired.json"), "w") as f:
+        json.dump(retired, f, indent=4, sort_keys=True)
+    with open(os.path.join(target, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+    return manifest
+
+
+def _retire(app, replaced, current):
+    """
+    Record when each of `replaced` stopped being current, and delete files
+    retired for longer than ASSETS_KEEP_RETIRED. Returns the retired files
+    still kept, with the time each was retired.
+    """
+    folder = dist_folder(app)
+    now = time.time()
+    retired = {
+        name: since for name, since in load_retired(app).items() if name not in current
+    }
+    for name in replaced:
+        retired.setdefault(name, now)
+
+    for name, since in list(retired.items()):
+        if now - since > app.config["ASSETS_KEEP_RETIRED"]:
+            for extension in ("", *ENCODINGS.values()):
+                try:
+                    os.remove(os.path.join(folder, name + extension))
+                except FileNotFoundError:
+                    pass
+            del retired[name]
+    return retired
+
+
+def load_manifest(app):
+    """The manifest written by the last build, or an empty one if there hasn't been one."""
+    try:
+        with open(os.path.join(dist_folder(app), "manifest.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def load_retired(app):
+    """Files replaced by later builds but still kept, with when each was retired."""
+    try:
+        with open(os.path.join(dist_folder(app), "retired.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def has_asset(name):
+    """Whether the static file `name` exists, built or not."""
+    return name in current_app.extensions["asset_manifest"] or os.path.isfile(
+        os.path.join(current_app.static_folder, name)
+    )
+
+
+def asset_url(name):
+    """URL of the static file `name`, fingerprinted if it has been built."""
+    fingerprinted = current_app.extensions["asset_manifest"].get(name)
+    if fingerprinted is None:
+        return url_for("static", filename=name)
+    return url_for("asset", filename=fingerprinted)
+
+
+def asset(filename):
+    """Serve a fingerprinted file, precompressed if the client accepts it."""
+    app = current_app
+    if filename not in app.extensions["asset_fingerprints"]:
+        abort(404)
+
+    folder = dist_folder(app)
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    encoding = None
+    for candidate, extension in ENCODINGS.items():
+        if request.accept_encodings[candidate] and os.path.exists(os.path.join(folder, filename + extension)):
+            encoding = candidate
+            break
+
+    response = send_from_directory(
+        folder,
+        filename + ENCODINGS[encoding] if encoding else filename,
+        mimetype=mimetype,
+        max_age=ONE_YEAR,
+    )
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    response.cache_control.immutable = True
+    return response
+
+
+def template_classes(app):
+    """Every class name written literally in a class attribute of a template."""
+    classes = set()
+    for directory, _, files in os.walk(os.path.join(app.root_path, app.template_folder)):
+        for file in files:
+            with open(os.path.join(directory, file)) as f:
+                for attribute in CLASS_ATTRIBUTE.findall(f.read()):
+                    # Skip anything templated, such as {{ ... }}
+                    classes.update(name for name in attribute.split() if not set(name) & set("{}%"))
+    return classes
+
+
+def _blocks(css):
+    """
+    Split a stylesheet into its top level (prelude, body) pairs, body being
+    None for statements such as @charset. Comments are dropped, except for
+    /*! license */ ones, which come back as (comment, None).
+    """
+    i = 0
+    start = 0
+    depth = 0
+    quote = None
+    prelude = None
+    while i < len(css):
+        char = css[i]
+        if quote:
+            if char == "\\":
+                i += 1
+            elif char == quote:
+                quote = None
+        elif char in "\"'":
+            quote = char
+        elif css.startswith("/*", i):
+            end = css.find("*/", i + 2)
+            end = len(css) if end == -1 else end + 2
+            if depth == 0:
+                if css.startswith("/*!", i):
+                    yield css[i:end], None
+                css = css[:i] + css[end:]
+                continue
+            i = end
+            continue
+        elif char == "{":
+            if depth == 0:
+                prelude = css[start:i].strip()
+                start = i + 1
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                yield prelude, css[start:i]
+                start = i + 1
+        elif char == ";" and depth == 0:
+            yield css[start:i].strip(), None
+            start = i + 1
+        i += 1
+
+
+def _selectors(prelude):
+    """Split a selector list on its top level commas."""
+    selectors = []
+    depth = 0
+    start = 0
+    for i, char in enumerate(prelude):
+        if char in "([":
+            depth += 1
+        elif char in ")]":
+            depth -= 1
+        elif char == "," and depth == 0:
+            selectors.append(prelude[start:i])
+            start = i + 1
+    selectors.append(prelude[start:])
+    return [selector.strip() for selector in selectors]
+
+
+def purge_css(css, used):
+    """
+    Drop the rules of `css` that can't match an element using only the
+    classes in `used`. A selector is kept if every class it requires is used;
+    rules without class selectors, @font-face and @keyframes are kept.
+    """
+    output = []
+    for prelude, body in _blocks(css):
+        if not prelude:
+            continue
+        if body is None:
+            output.append(prelude if prelude.startswith("/*") else prelude + ";")
+        elif prelude.startswith("@"):
+            name = re.match(r"@([\w-]+)", prelude).group(1)
+            if name in NESTING_AT_RULES:
+                body = purge_css(body, used)
+                if body:
+                    output.append(f"{prelude}{{{body}}}")
+            else:
+                output.append(f"{prelude}{{{body}}}")
+        else:
+            selectors = [
+                selector for selector in _selectors(prelude)
+                if set(SELECTOR_CLASS.findall(NEGATION.sub("", selector))) <= used
+            ]
+            if selectors:
+                output.append(f"{','.join(selectors)}{{{body}}}")
+    return "".join(output)
+
+
+def _read(path, url):
+    """Contents of `path`, or else of `url`."""
+    if path:
+        with open(path, "rb") as f:
+            return f.read()
+    try:
+        with urllib.request.urlopen(url, timeout=30) as response:
+            return response.read()
+    except OSError as error:
+        raise click.ClickException(f"Couldn't download {url} ({error}), pass a local copy instead.")
+
+
+# Line of bootstrap-report.txt listing the classes kept
+REPORT_CLASSES = "Classes: "
+
+
+def report_path(app):
+    return os.path.join(app.root_path, "bootstrap-report.txt")
+
+
+def purged_classes(app):
+    """The classes static/bootstrap.min.css was last purged for, per its report."""
+    with open(report_path(app)) as f:
+        for line in f:
+            if line.startswith(REPORT_CLASSES):
+                return set(line[len(REPORT_CLASSES):].split())
+    return set()
+
+
+def _sizes(data):
+    return f"{len(data)} B, gzip {len(gzip.compress(data, compresslevel=9))} B"
+
+
+assets_cli = AppGroup("assets", help="Build fingerprinted static assets.")
+
+
+@assets_cli.command("bootstrap")
+@click.option("--css", "css_path", type=click.Path(exists=True, dir_okay=False), help=f"Local copy of bootstrap.min.css {BOOTSTRAP_VERSION}.")
+@click.option("--js", "js_path", type=click.Path(exists=True, dir_okay=False), help=f"Local copy of bootstrap.bundle.min.js {BOOTSTRAP_VERSION}, measured for the size report.")
+def bootstrap_command(css_path, js_path):
+    """
+    Write static/bootstrap.min.css with only the rules the templates use,
+    record the sizes in bootstrap-report.txt, then build.
+    """
+    app = current_app._get_current_object()
+    css = _read(css_path, BOOTSTRAP_CSS_URL)
+    bundle = _read(js_path, BOOTSTRAP_JS_URL) # only measured, so the report has both sizes
+    used = template_classes(app) | SAFELIST
+    purged = purge_css(css.decode(), used).encode()
+
+    with open(os.path.join(app.static_folder, "bootstrap.min.css"), "wb") as f:
+        f.write(purged)
+    with open(os.path.join(app.static_folder, "nav.js"), "rb") as f:
+        script = f.read()
+
+    report = [
+        f"Bootstrap {BOOTSTRAP_VERSION}, kept rules for {len(used)} classes.",
+        f"CSS: bootstrap.min.css {_sizes(css)} -> {_sizes(purged)}",
+        f"JS:  bootstrap.bundle.min.js {_sizes(bundle)} -> nav.js {_sizes(script)}",
+    ]
+    for line in report:
+        click.echo(line)
+
+    with open(report_path(app), "w") as f:
+        f.write("\n".join(report) + "\n")
+        f.write(f"{REPORT_CLASSES}{' '.join(sorted(used))}\n")
+
+    click.get_current_context().invoke(build_command)
+
+
+@assets_cli.command("build")
+def build_command():
+    """Fingerprint and precompress static/ into static/dist/."""
+    app = current_app._get_current_object()
+    manifest = build(app)
+    folder = dist_folder(app)
+    for name, fingerprinted in sorted(manifest.items()):
+        path = os.path.join(folder, fingerprinted)
+        sizes = [f"{os.path.getsize(path)} B"]
+        for encoding, extension in ENCODINGS.items():
+            if os.path.exists(path + extension):
+                sizes.append(f"{encoding} {os.path.getsize(path + extension)} B")
+        click.echo(f"{name} -> {fingerprinted} ({', '.join(sizes)})")
+    if brotli is None:
+        click.echo("brotli isn't installed, so only gzip variants were written.")
+    retired = load_retired(app)
+    if retired:
+        click.echo(f"Kept {len(retired)} retired files from earlier builds.")
+    _use_manifest(app, manifest)
+
+
+def _use_manifest(app, manifest):
+    app.extensions["asset_manifest"] = manifest
+    app.extensions["asset_fingerprints"] = set(manifest.values()) | set(load_retired(app))
+
+
+def init_assets(app):
+    app.config.setdefault("ASSETS_KEEP_RETIRED", 7 * 24 * 60 * 60)
+    _use_manifest(app, load_manifest(app))
+    app.add_url_rule("/assets/<path:filename>", "asset", asset)
+    app.add_template_global(asset_url)
+    app.add_template_global(has_asset)
+    app.cli.add_command(assets_cli)
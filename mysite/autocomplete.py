@@ -0,0 +1,241 @@
+"""
+Suggestions for the topics and provider fields as they are typed.
+
+Each user's vocabulary, and the vocabulary shared by several users, is held
+in memory as sorted arrays of normalized keys, so a lookup is a bisection
+plus a short scan. A user's index is built on first use and stamped with
+their data version: writes made through this process update it in place,
+and any other change to their data (e.g. from another worker) is noticed
+by the version moving on, and rebuilds it. The shared vocabulary is rebuilt
+in the background every AUTOCOMPLETE_GLOBAL_TTL seconds.
+"""
+import bisect
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+from cache import data_version
+from database import get_pool
+from topics import split_topics, topic_key
+
+FIELDS = ("topics", "provider")
+
+# Matches considered for ranking, however many share a short prefix
+MAX_CANDIDATES = 200
+
+
+class PrefixIndex:
+    """Labels counted by normalized key, kept sorted for prefix lookups."""
+
+    def __init__(self):
+        self._keys = []
+        self._entries = {}
+
+    def add(self, label, count=1):
+        key = topic_key(label)
+        if not key:
+            return
+        entry = self._entries.get(key)
+        if entry is None:
+            bisect.insort(self._keys, key)
+            self._entries[key] = [label, count]
+        else:
+            entry[1] += count
+
+    def remove(self, label, count=1):
+        key = topic_key(label)
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        entry[1] -= count
+        if entry[1] <= 0:
+            del self._entries[key]
+            del self._keys[bisect.bisect_left(self._keys, key)]
+
+    def complete(self, prefix, limit):
+        """Labels starting with `prefix`, most used first."""
+        prefix = topic_key(prefix)
+        start = bisect.bisect_left(self._keys, prefix)
+        matches = []
+        for key in self._keys[start:start + MAX_CANDIDATES]:
+            if not key.startswith(prefix):
+                break
+            matches.append(self._entries[key])
+        matches.sort(key=lambda entry: -entry[1])
+        return [label for label, _ in matches[:limit]]
+
+    def __len__(self):
+        return len(self._keys)
+
+
+def _vocabulary(entries):
+    """Topics and provider indexes over (topics field, provider) pairs."""
+    indexes = {field: PrefixIndex() for field in FIELDS}
+    for topics, provider in entries:
+        for _, label in split_topics(topics):
+            indexes["topics"].add(label)
+        indexes["provider"].add(provider)
+    return indexes
+
+
+class Autocomplete:
+    def __init__(self, max_users=1000, global_ttl=300, global_min_users=2):
+        self.max_users = max_users
+        self.global_ttl = global_ttl
+        self.global_min_users = global_min_users
+
+        self._users = OrderedDict()
+        self._global = {field: PrefixIndex() for field in FIELDS}
+        self._global_built = None
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+        self.lookups = 0
+        self.rebuilds = 0
+        self.updates = 0
+
+    def _user(self, db, user_id):
+        """`user_id`'s indexes, rebuilt if their data has changed since."""
+        version = data_version(db, user_id)
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None and entry[0] == version:
+                self._users.move_to_end(user_id)
+                return entry[1]
+
+        indexes = _vocabulary(db.execute(
+            "SELECT topics, provider FROM courses WHERE user_id = ?", (user_id,)
+        ))
+        with self._lock:
+            self.rebuilds += 1
+            self._users[user_id] = (version, indexes)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return indexes
+
+    def refresh_global(self, conn):
+        """Rebuild the shared vocabulary from topics and providers used by enough users."""
+        indexes = {field: PrefixIndex() for field in FIELDS}
+        for label, users in conn.execute(
+            "SELECT ( \
+                SELECT spelling.label FROM course_topics AS spelling \
+                WHERE spelling.topic_id = course_topics.topic_id \
+                GROUP BY spelling.label ORDER BY COUNT(*) DESC, spelling.label LIMIT 1 \
+            ), COUNT(DISTINCT courses.user_id) FROM course_topics \
+            JOIN courses ON courses.id = course_topics.course_id \
+            GROUP BY course_topics.topic_id HAVING COUNT(DISTINCT courses.user_id) >= ?",
+            (self.global_min_users,)
+        ):
+            indexes["topics"].add(label, users)
+        for label, users in conn.execute(
+            "SELECT provider, COUNT(DISTINCT user_id) FROM courses \
+            GROUP BY provider HAVING COUNT(DISTINCT user_id) >= ?",
+            (self.global_min_users,)
+        ):
+            indexes["provider"].add(label, users)
+
+        with self._lock:
+            self._global = indexes
+            self._global_built = time.monotonic()
+
+    def _refresh_global(self, app):
+        """refresh_global() on a pooled connection, for a background thread."""
+        pool = get_pool(app)
+        conn = pool.acquire()
+        try:
+            self.refresh_global(conn)
+        except Exception:
+            app.logger.exception("Autocomplete refresh failed")
+            with self._lock:
+                self._global_built = time.monotonic()
+        finally:
+            pool.release(conn)
+            with self._lock:
+                self._refreshing = False
+
+    def _shared(self):
+        """The shared indexes, refreshing them in the background once stale."""
+        with self._lock:
+            stale = self._global_built is None or time.monotonic() - self._global_built > self.global_ttl
+            refresh = stale and not self._refreshing
+            if refresh:
+                self._refreshing = True
+            indexes = self._global
+
+        if refresh:
+            app = current_app._get_current_object()
+            threading.Thread(target=self._refresh_global, args=(app,), daemon=True).start()
+        return indexes
+
+    def complete(self, db, user_id, field, prefix, limit=10):
+        """Suggestions for `field` starting with `prefix`: the user's own first."""
+        own = self._user(db, user_id)[field]
+        shared = self._shared()[field]
+        with self._lock:
+            self.lookups += 1
+            suggestions = own.complete(prefix, limit)
+            if len(suggestions) < limit:
+                seen = {topic_key(label) for label in suggestions}
+                suggestions += [
+                    label for label in shared.complete(prefix, limit)
+                    if topic_key(label) not in seen
+                ][:limit - len(suggestions)]
+        return suggestions
+
+    def record(self, user_id, version, removed=(), added=()):
+        """
+        Apply a write of (topics field, provider) pairs to `user_id`'s indexes,
+        `version` being their data version after it.
+
+        Only a write following straight on from the indexed version can be
+        applied; otherwise they are rebuilt on next use.
+        """
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None:
+                return
+            if entry[0] != version - 1:
+                del self._users[user_id]
+                return
+
+            indexes = entry[1]
+            for topics, provider in removed:
+                for _, label in split_topics(topics):
+                    indexes["topics"].remove(label)
+                indexes["provider"].remove(provider)
+            for topics, provider in added:
+                for _, label in split_topics(topics):
+                    indexes["topics"].add(label)
+                indexes["provider"].add(provider)
+            self._users[user_id] = (version, indexes)
+            self.updates += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "users": len(self._users),
+                "global_topics": len(self._global["topics"]),
+                "global_providers": len(self._global["provider"]),
+                "lookups": self.lookups,
+                "rebuilds": self.rebuilds,
+                "updates": self.updates,
+            }
+
+
+def get_autocomplete(app=None):
+    app = app or current_app
+    return app.extensions["autocomplete"]
+
+
+def init_autocomplete(app):
+    app.config.setdefault("AUTOCOMPLETE_USERS", 1000)
+    app.config.setdefault("AUTOCOMPLETE_GLOBAL_TTL", 5 * 60)
+    app.config.setdefault("AUTOCOMPLETE_GLOBAL_MIN_USERS", 2)
+    app.extensions["autocomplete"] = Autocomplete(
+        app.config["AUTOCOMPLETE_USERS"],
+        app.config["AUTOCOMPLETE_GLOBAL_TTL"],
+        app.config["AUTOCOMPLETE_GLOBAL_MIN_USERS"],
+    )
@@ -0,0 +1,340 @@
+"""
+Benchmarks run through `flask bench ...`.
+
+Benchmarks never touch the live database: anything that writes works on a
+temporary copy.
+"""
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from flask_session.sessions import FileSystemSessionInterface
+from werkzeug.security import generate_password_hash
+
+from autocomplete import FIELDS, Autocomplete
+from database import DEFAULT_PRAGMAS, ConnectionPool, connect
+from passwords import canonical_method
+from search import find_entries
+from sessions import SignedSessionInterface, SQLiteSessionInterface, signing_keys
+from topics import link_topics
+
+bench_cli = AppGroup("bench", help="Measure performance on this host.")
+
+
+def percentiles(samples):
+    """Summarise latency samples (in seconds) as milliseconds."""
+    samples = sorted(samples)
+    if not samples:
+        return "no samples"
+
+    def at(fraction):
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))] * 1000
+
+    return (
+        f"n={len(samples)} mean={statistics.fmean(samples) * 1000:.3f}ms "
+        f"p50={at(0.50):.3f}ms p95={at(0.95):.3f}ms p99={at(0.99):.3f}ms max={samples[-1] * 1000:.3f}ms"
+    )
+
+
+def copy_database(directory):
+    """Snapshot the configured database into `directory`, returning its path."""
+    path = os.path.join(directory, "courses.db")
+    source = sqlite3.connect(current_app.config["DATABASE"])
+    target = sqlite3.connect(path)
+    with target:
+        source.backup(target)
+    source.close()
+    target.close()
+    return path
+
+
+def _reads_under_writes(path, pragmas, readers, seconds):
+    """
+    Time listing reads on `readers` threads while one thread keeps committing.
+
+    Returns (read samples, commits, errors), errors counting reads and
+    writes that failed, e.g. with "database is locked".
+    """
+    # The journal mode belongs to the database file, so it is switched once
+    # up front; switching it from every thread would make them lock each other
+    pragmas = dict(pragmas)
+    setup = connect(path)
+    setup.execute(f"PRAGMA journal_mode = {pragmas.pop('journal_mode', 'delete')}")
+    user_id = setup.execute("SELECT MIN(id) FROM users").fetchone()[0] or 1
+    setup.close()
+
+    stop = threading.Event()
+    samples = []
+    writes = 0
+    errors = 0
+
+    def read():
+        nonlocal errors
+        conn = connect(path, pragmas)
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                conn.execute(
+                    "SELECT * FROM courses WHERE user_id = ? AND is_course = 1 ORDER BY name",
+                    (user_id,)
+                ).fetchall()
+            except sqlite3.OperationalError:
+                errors += 1
+                continue
+            samples.append(time.perf_counter() - started)
+        conn.close()
+
+    def write():
+        nonlocal writes, errors
+        conn = connect(path, pragmas)
+        while not stop.is_set():
+            try:
+                conn.execute(
+                    "INSERT INTO courses (user_id, name, topics, desc, provider, is_complete, is_course) \
+                    VALUES (?, ?, 'Benchmark', 'Benchmark', 'Benchmark', 0, 1)",
+                    (user_id, f"bench-{writes}",)
+                )
+                conn.commit()
+            except sqlite3.OperationalError:
+                conn.rollback()
+                errors += 1
+                continue
+            writes += 1
+        conn.close()
+
+    threads = [threading.Thread(target=read) for _ in range(readers)]
+    threads.append(threading.Thread(target=write))
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    return samples, writes, errors
+
+
+@bench_cli.command("pragmas")
+@click.option("--readers", default=4, show_default=True, help="Concurrent reader threads.")
+@click.option("--seconds", default=5.0, show_default=True, help="Duration of each run.")
+def pragmas_command(readers, seconds):
+    """Compare read latency under concurrent writes, before and after the pragma profile."""
+    profiles = {
+        "rollback journal (SQLite defaults)": {"busy_timeout": 5000, "journal_mode": "delete", "synchronous": "full"},
+        "configured profile": current_app.config.get("DATABASE_PRAGMAS", DEFAULT_PRAGMAS),
+    }
+
+    for label, pragmas in profiles.items():
+        directory = tempfile.mkdtemp()
+        try:
+            path = copy_database(directory)
+            samples, writes, errors = _reads_under_writes(path, pragmas, readers, seconds)
+        finally:
+            shutil.rmtree(directory)
+
+        click.echo(f"{label}: {pragmas}")
+        click.echo(f"  reads  {percentiles(samples)}")
+        click.echo(f"  writes {writes / seconds:.0f} commits/s")
+        if errors:
+            click.echo(f"  {errors} reads or writes failed")
+
+
+@bench_cli.command("sessions")
+@click.option("--requests", "count", default=2000, show_default=True, help="Requests per session mode.")
+@click.option("--path", default="/", show_default=True, help="Logged in page to request.")
+def sessions_command(count, path):
+    """Compare per-request latency of a logged in page across session stores."""
+    app = current_app._get_current_object()
+    directory = tempfile.mkdtemp()
+    live_pool = app.extensions.get("db_pool")
+    live_interface = app.session_interface
+
+    try:
+        path_copy = copy_database(directory)
+        user_id = connect(path_copy).execute("SELECT MIN(id) FROM users").fetchone()[0]
+        app.extensions["db_pool"] = ConnectionPool(path_copy, pragmas=app.config["DATABASE_PRAGMAS"])
+
+        modes = {
+            "filesystem": FileSystemSessionInterface(
+                os.path.join(directory, "flask_session"), 0, 0o600, "session:", permanent=False
+            ),
+            "sqlite": SQLiteSessionInterface(),
+        }
+        if app.secret_key or app.config["SESSION_SIGNING_KEYS"]:
+            modes["signed"] = SignedSessionInterface(SQLiteSessionInterface(), signing_keys(app))
+        else:
+            click.echo("Skipping signed mode: set SECRET_KEY or SESSION_SIGNING_KEYS.")
+
+        for label, interface in modes.items():
+            app.session_interface = interface
+            client = app.test_client()
+            with client.session_transaction() as session:
+                session["user_id"] = user_id
+            client.get(path)
+
+            samples = []
+            for _ in range(count):
+                started = time.perf_counter()
+                client.get(path)
+                samples.append(time.perf_counter() - started)
+            click.echo(f"{label}: {percentiles(samples)}")
+    finally:
+        app.session_interface = live_interface
+        app.extensions["db_pool"] = live_pool
+        shutil.rmtree(directory)
+
+
+@bench_cli.command("search")
+@click.option("--rows", default=100000, show_default=True, help="Synthetic entries to add, spread over 100 new users.")
+@click.option("--queries", default=500, show_default=True, help="Searches to time.")
+def search_command(rows, queries):
+    """Time full-text searches on a copy of the database grown by `--rows` entries."""
+    directory = tempfile.mkdtemp()
+    try:
+        conn = connect(copy_database(directory), current_app.config["DATABASE_PRAGMAS"])
+        vocabulary = ["".join(random.choices("abcdefghijklmnopqrstuvwxyz", k=random.randint(4, 9))) for _ in range(5000)]
+        conn.executemany(
+            "INSERT INTO courses (user_id, name, topics, desc, provider, is_complete, is_course) \
+            VALUES (?, ?, ?, ?, ?, 0, 1)",
+            (
+                (
+                    10**9 + i % 100,
+                    f"{' '.join(random.choices(vocabulary, k=3))} {i}",
+                    ", ".join(random.choices(vocabulary, k=3)),
+                    " ".join(random.choices(vocabulary, k=30)),
+                    random.choice(vocabulary),
+                )
+                for i in range(rows)
+            )
+        )
+        conn.commit()
+
+        samples = []
+        for _ in range(queries):
+            text = " ".join(word[:random.randint(2, 5)] for word in random.choices(vocabulary, k=random.randint(1, 2)))
+            started = time.perf_counter()
+            find_entries(conn, 10**9 + random.randrange(100), text)
+            samples.append(time.perf_counter() - started)
+        conn.close()
+    finally:
+        shutil.rmtree(directory)
+
+    click.echo(f"search over {rows} extra entries: {percentiles(samples)}")
+
+
+@bench_cli.command("autocomplete")
+@click.option("--rows", default=100000, show_default=True, help="Synthetic entries to add, spread over 100 new users.")
+@click.option("--lookups", default=5000, show_default=True, help="Suggestion lookups to time.")
+@click.option("--target", default=2.0, show_default=True, help="Acceptable p99 milliseconds per lookup.")
+def autocomplete_command(rows, lookups, target):
+    """Time topic and provider suggestions on a copy of the database grown by `--rows` entries."""
+    directory = tempfile.mkdtemp()
+    try:
+        conn = connect(copy_database(directory), current_app.config["DATABASE_PRAGMAS"])
+        vocabulary = ["".join(random.choices("abcdefghijklmnopqrstuvwxyz", k=random.randint(4, 9))) for _ in range(5000)]
+        first_id = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM courses").fetchone()[0]
+        entries = [
+            (
+                first_id + i,
+                10**9 + i % 100,
+                f"Benchmark {i}",
+                ", ".join(random.choices(vocabulary, k=3)),
+                random.choice(vocabulary[:500]),
+            )
+            for i in range(rows)
+        ]
+        conn.executemany(
+            "INSERT INTO courses (id, user_id, name, topics, desc, provider, is_complete, is_course) \
+            VALUES (?, ?, ?, ?, 'Benchmark', ?, 0, 1)",
+            entries
+        )
+        link_topics(conn, [(course_id, topics) for course_id, _, _, topics, _ in entries], new=True)
+        conn.commit()
+
+        autocomplete = Autocomplete(
+            current_app.config["AUTOCOMPLETE_USERS"],
+            current_app.config["AUTOCOMPLETE_GLOBAL_TTL"],
+            current_app.config["AUTOCOMPLETE_GLOBAL_MIN_USERS"],
+        )
+        started = time.perf_counter()
+        autocomplete.refresh_global(conn)
+        shared = time.perf_counter() - started
+
+        # First lookup per user builds their indexes
+        cold = []
+        for user_id in range(10**9, 10**9 + 100):
+            started = time.perf_counter()
+            autocomplete.complete(conn, user_id, "topics", random.choice(vocabulary)[:2])
+            cold.append(time.perf_counter() - started)
+
+        # CPU time leaves out waits for the CPU, telling a busy host apart
+        # from slow lookups
+        samples = []
+        cpu = []
+        for _ in range(lookups):
+            prefix = random.choice(vocabulary)[:random.randint(1, 4)]
+            user_id = 10**9 + random.randrange(100)
+            started, started_cpu = time.perf_counter(), time.thread_time()
+            autocomplete.complete(conn, user_id, random.choice(FIELDS), prefix)
+            samples.append(time.perf_counter() - started)
+            cpu.append(time.thread_time() - started_cpu)
+        conn.close()
+    finally:
+        shutil.rmtree(directory)
+
+    click.echo(f"shared vocabulary built in {shared * 1000:.0f}ms")
+    click.echo(f"first lookup per user: {percentiles(cold)}")
+    p99 = sorted(samples)[min(len(samples) - 1, int(0.99 * len(samples)))] * 1000
+    click.echo(
+        f"lookups over {rows} extra entries: {percentiles(samples)}"
+        + (" (over target)" if p99 > target else "")
+    )
+    click.echo(f"  CPU time per lookup: {percentiles(cpu)}")
+
+
+# Candidate password hash methods for `flask bench kdf`
+KDF_CANDIDATES = (
+    "scrypt:16384:8:1",
+    "scrypt:32768:8:1",
+    "scrypt:65536:8:1",
+    "pbkdf2:sha256:600000",
+    "pbkdf2:sha256:1000000",
+)
+
+
+@bench_cli.command("kdf")
+@click.option("--method", "methods", multiple=True, help="Hash method to time; repeat to compare several.")
+@click.option("--rounds", default=10, show_default=True, help="Hashes per method.")
+@click.option("--budget", default=250.0, show_default=True, help="Acceptable milliseconds per hash.")
+def kdf_command(methods, rounds, budget):
+    """Time password hash methods on this host, to pick PASSWORD_HASH_METHOD."""
+    configured = canonical_method(current_app.config["PASSWORD_HASH_METHOD"])
+    methods = [canonical_method(method) for method in methods or KDF_CANDIDATES]
+    if configured not in methods:
+        methods.append(configured)
+
+    for method in methods:
+        samples = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            generate_password_hash("benchmark password", method)
+            samples.append(time.perf_counter() - started)
+
+        notes = []
+        if method == configured:
+            notes.append("configured")
+        if statistics.median(samples) * 1000 > budget:
+            notes.append("over budget")
+        click.echo(f"{method}: {percentiles(samples)}" + (f" ({', '.join(notes)})" if notes else ""))
+
+
+def init_benchmarks(app):
+    app.cli.add_command(bench_cli)
@@ -0,0 +1,179 @@
+"""
+Per-user read cache for the listing pages.
+
+Entries are keyed by (user_id, view, key) and stamped with the user's data
+version, which triggers on courses bump in the same transaction as every
+write. A lookup whose stamp no longer matches is a miss, so no write path
+has to remember to invalidate anything, and the version being in the
+database keeps every worker process consistent.
+
+The same version gives the listing pages an ETag, so a browser revisiting
+one that hasn't changed gets a 304 without anything being rendered.
+"""
+import hashlib
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, g, make_response, request, session
+
+from database import get_db
+
+
+def data_version(db, user_id):
+    """Counter bumped on every write to `user_id`'s entries."""
+    row = db.execute("SELECT version FROM user_versions WHERE user_id = ?", (user_id,)).fetchone()
+    return row[0] if row else 0
+
+
+def _sizeof(value):
+    """Rough in-memory size of a cached value, in bytes."""
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        size += sum(_sizeof(item) for item in value)
+    elif isinstance(value, dict):
+        size += sum(_sizeof(key) + _sizeof(item) for key, item in value.items())
+    elif hasattr(value, "__dict__"):
+        size += _sizeof(vars(value))
+    return size
+
+
+class ListingCache:
+    """LRU cache bounded by both entry count and approximate size in bytes."""
+
+    def __init__(self, max_entries=1024, max_bytes=16 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, version, value):
+        size = _sizeof(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+
+            self._entries[key] = (version, value, size)
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+def get_cache(app=None):
+    app = app or current_app
+    return app.extensions["listing_cache"]
+
+
+def cached(view, key, load):
+    """
+    Return `load()` for the logged in user's `view`, identified by `key`.
+
+    The result is reused until the user's data changes.
+    """
+    user_id = session["user_id"]
+    version = g.data_version if "data_version" in g else data_version(get_db(), user_id)
+    cache = get_cache()
+
+    value = cache.get((user_id, view, key), version)
+    if value is None:
+        value = load()
+        cache.put((user_id, view, key), version, value)
+    return value
+
+
+def conditional(f):
+    """
+    Decorate listing routes to answer If-None-Match with 304 Not Modified.
+
+    The ETag covers the user's data version, the route and its query
+    parameters, and a salt that changes with the templates and assets, so
+    checking it costs one primary key read.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        # Pages showing flashed messages are one-offs
+        if request.method not in ("GET", "HEAD") or "_flashes" in session:
+            return f(*args, **kwargs)
+
+        user_id = session["user_id"]
+        g.data_version = data_version(get_db(), user_id)
+        key = [
+            _etag_salt(current_app),
+            user_id,
+            g.data_version,
+            request.endpoint,
+            sorted(request.args.items(multi=True)),
+        ]
+        etag = hashlib.sha256(json.dumps(key).encode()).hexdigest()[:32]
+
+        if etag in request.if_none_match:
+            response = current_app.response_class(status=304)
+        else:
+            response = make_response(f(*args, **kwargs))
+        response.set_etag(etag)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+    return decorated_function
+
+
+def _etag_salt(app):
+    """LISTING_ETAG_SALT, defaulting to a hash of the templates and asset manifest."""
+    salt = app.config["LISTING_ETAG_SALT"] or app.extensions.get("listing_etag_salt")
+    if salt:
+        return salt
+
+    digest = hashlib.sha256()
+    template_folder = os.path.join(app.root_path, app.template_folder)
+    for directory, _, files in sorted(os.walk(template_folder)):
+        for file in sorted(files):
+            with open(os.path.join(directory, file), "rb") as f:
+                digest.update(f.read())
+    digest.update(json.dumps(app.extensions.get("asset_manifest", {}), sort_keys=True).encode())
+    salt = app.extensions["listing_etag_salt"] = digest.hexdigest()[:16]
+    return salt
+
+
+def init_cache(app):
+    app.config.setdefault("LISTING_CACHE_ENTRIES", 1024)
+    app.config.setdefault("LISTING_CACHE_BYTES", 16 * 1024 * 1024)
+    app.config.setdefault("LISTING_ETAG_SALT", None)
+    app.extensions["listing_cache"] = ListingCache(
+        app.config["LISTING_CACHE_ENTRIES"], app.config["LISTING_CACHE_BYTES"]
+    )
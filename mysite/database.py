@@ -0,0 +1,159 @@
+import queue
+import sqlite3
+import threading
+import time
+
+from flask import current_app, g
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes free in time."""
+
+
+# Applied to every connection as it is opened. WAL lets readers carry on
+# while a write commits, and synchronous=NORMAL is durable under WAL except
+# across power loss.
+DEFAULT_PRAGMAS = {
+    "busy_timeout": 5000,
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "mmap_size": 64 * 1024 * 1024,
+    "cache_size": -16000,
+    "temp_store": "memory",
+}
+
+
+def connect(path, pragmas=None):
+    """Open a connection to `path` and apply the pragma profile to it."""
+    conn = sqlite3.connect(path, check_same_thread=False)
+    for name, value in (pragmas or {}).items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+
+class ConnectionPool:
+    """
+    Bounded pool of SQLite connections.
+
+    Connections are opened lazily up to `size`, after which callers wait for
+    one to be released. Each connection is only ever used by one thread at a
+    time, so sharing them across worker threads is safe.
+    """
+
+    def __init__(self, path, size=8, timeout=10, pragmas=None):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = pragmas
+
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+
+    def _connect(self):
+        return connect(self.path, self.pragmas)
+
+    def acquire(self):
+        """Check out a connection, opening or waiting for one as needed."""
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+
+        if conn is None:
+            with self._lock:
+                if self._opened < self.size:
+                    self._opened += 1
+                    opening = True
+                else:
+                    opening = False
+
+            if opening:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._opened -= 1
+                    raise
+            else:
+                started = time.perf_counter()
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise PoolTimeout(f"No database connection free after {self.timeout}s.")
+                finally:
+                    with self._lock:
+                        self.waits += 1
+                        self.wait_time += time.perf_counter() - started
+
+        with self._lock:
+            self.checkouts += 1
+        return conn
+
+    def release(self, conn):
+        """Return a connection to the pool, discarding any uncommitted work."""
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+            return
+        self._idle.put(conn)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "opened": self._opened,
+                "idle": self._idle.qsize(),
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "wait_time": round(self.wait_time, 6),
+            }
+
+
+_pool_lock = threading.Lock()
+
+
+def get_pool(app=None):
+    """Return the app's connection pool, creating it on first use."""
+    app = app or current_app
+    pool = app.extensions.get("db_pool")
+    if pool is None:
+        with _pool_lock:
+            pool = app.extensions.get("db_pool")
+            if pool is None:
+                pool = ConnectionPool(
+                    app.config["DATABASE"],
+                    size=app.config["DATABASE_POOL_SIZE"],
+                    timeout=app.config["DATABASE_POOL_TIMEOUT"],
+                    pragmas=app.config["DATABASE_PRAGMAS"],
+                )
+                app.extensions["db_pool"] = pool
+    return pool
+
+
+def get_db():
+    """Check out a connection for the current request, reusing it if held."""
+    if "db" not in g:
+        g.db = get_pool().acquire()
+    return g.db
+
+
+def close_db(exception=None):
+    """Give the request's connection back to the pool."""
+    conn = g.pop("db", None)
+    if conn is not None:
+        get_pool().release(conn)
+
+
+def init_db(app):
+    app.config.setdefault("DATABASE_POOL_SIZE", 8)
+    app.config.setdefault("DATABASE_POOL_TIMEOUT", 10)
+    app.config.setdefault("DATABASE_PRAGMAS", dict(DEFAULT_PRAGMAS))
+    app.teardown_appcontext(close_db)
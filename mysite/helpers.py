@@ -1,4 +1,4 @@
-from flask import redirect, render_template, session
+from flask import make_response, redirect, render_template, request, session
 from functools import wraps
 
 def login_required(f):
@@ -13,3 +13,23 @@ def login_required(f):
             return redirect("/login")
         return f(*args, **kwargs)
     return decorated_function
+
+def cache_control(**directives):
+    """
+    Decorate routes to declare how browsers may cache their pages,
+    e.g. @cache_control(private=True, max_age=600).
+
+    Only successful GET responses without flashed messages are marked;
+    anything else, and routes without a policy, aren't cached at all.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            flashed = "_flashes" in session
+            response = make_response(f(*args, **kwargs))
+            if request.method in ("GET", "HEAD") and response.status_code == 200 and not flashed:
+                for directive, value in directives.items():
+                    setattr(response.cache_control, directive, value)
+            return response
+        return decorated_function
+    return decorator
@@ -0,0 +1,218 @@
+"""
+Compile course listing specs into a single parameterized query.
+
+A ListingSpec names its filters and sort keys from the whitelists below, so
+user input only ever chooses between known SQL fragments and supplies bound
+parameters. The SQL for each distinct shape of spec is compiled once and
+cached.
+"""
+import base64
+import functools
+import json
+from dataclasses import dataclass, replace
+
+# Columns selected for every listing, in the order templates index them
+COLUMNS = ("id", "user_id", "name", "url", "topics", "desc", "provider", "is_complete", "is_course")
+
+# Sortable keys and the SQL each one sorts on. All are NOT NULL, and each
+# appears in an index after (user_id, is_course) so that listings read and
+# seek in index order; expressions must match their index exactly.
+SORT_KEYS = {
+    "name": "name",
+    "provider": "provider",
+    "is_complete": "is_complete",
+    # Completed, then in progress, then not started
+    "completed_first": "2 - is_complete",
+    # In progress, then completed, then not started
+    "in_progress_first": "CASE is_complete WHEN 1 THEN 0 WHEN 2 THEN 1 ELSE 2 END",
+}
+
+FILTER_FIELDS = {"is_complete", "provider"}
+FILTER_OPERATORS = {"=", "!="}
+DIRECTIONS = {"asc", "desc"}
+
+
+@dataclass(frozen=True)
+class ListingSpec:
+    """What to list: filters as (field, operator, value), sort as (key, direction)."""
+    is_course: bool
+    filters: tuple = ()
+    sort: tuple = (("name", "asc"),)
+    limit: int = None
+
+    def __post_init__(self):
+        for field, operator, _ in self.filters:
+            if field not in FILTER_FIELDS or operator not in FILTER_OPERATORS:
+                raise ValueError(f"Unsupported filter: {field} {operator}")
+        for key, direction in self.sort:
+            if key not in SORT_KEYS or direction not in DIRECTIONS:
+                raise ValueError(f"Unsupported sort: {key} {direction}")
+
+
+# The "Refine Results" options on the listing pages, as (filters, sort)
+SORT_PRESETS = {
+    "name": ((), (("name", "asc"),)),
+    "provider": ((), (("provider", "asc"), ("name", "asc"))),
+    "completed": ((), (("completed_first", "asc"), ("name", "asc"))),
+    "inProgress": ((), (("in_progress_first", "asc"), ("name", "asc"))),
+    "incomplete": ((), (("is_complete", "asc"), ("name", "asc"))),
+    "onlyCompleted": ((("is_complete", "=", 2),), (("name", "asc"),)),
+    "hideCompleted": ((("is_complete", "!=", 2),), (("completed_first", "asc"), ("name", "asc"))),
+}
+
+
+def spec_for(sort_index, is_course, limit=None):
+    """Build the spec for a "Refine Results" option, defaulting to by name."""
+    filters, sort = SORT_PRESETS.get(sort_index, SORT_PRESETS["name"])
+    return ListingSpec(is_course=is_course, filters=filters, sort=sort, limit=limit)
+
+
+def _seek(keys, backwards):
+    """WHERE clause resuming after (or before) a row's sort key values."""
+    flip = {"asc": "desc", "desc": "asc"}
+    directions = [flip[direction] if backwards else direction for _, direction in keys]
+    expressions = [expression for expression, _ in keys]
+
+    # Bounding the leading key on its own lets SQLite seek into the index even
+    # when that key is an expression
+    lead = f"{expressions[0]} {'>=' if directions[0] == 'asc' else '<='} ?"
+
+    if len(set(directions)) == 1:
+        operator = ">" if directions[0] == "asc" else "<"
+        placeholders = ", ".join("?" * len(keys))
+        clause = f"{lead} AND ({', '.join(expressions)}) {operator} ({placeholders})"
+        return clause, (0,) + tuple(range(len(keys)))
+
+    terms = []
+    order = [0]
+    for i, (expression, direction) in enumerate(zip(expressions, directions)):
+        equal = [f"{expressions[j]} = ?" for j in range(i)]
+        equal.append(f"{expression} {'>' if direction == 'asc' else '<'} ?")
+        terms.append("(" + " AND ".join(equal) + ")")
+        order.extend(range(i + 1))
+    return f"{lead} AND (" + " OR ".join(terms) + ")", tuple(order)
+
+
+@functools.lru_cache(maxsize=64)
+def _compile(filters, sort, limited, seek):
+    """
+    Compile the SQL for a spec's shape.
+
+    Returns the SQL and, for a seek, the order in which cursor values are
+    bound. Filter values and cursors don't affect the SQL, so specs that
+    differ only in those share one compiled query.
+    """
+    keys = [(SORT_KEYS[key], direction) for key, direction in sort]
+    keys.append(("id", "asc"))
+    backwards = seek == "before"
+
+    selected = list(COLUMNS) + [expression for expression, _ in keys[:-1]]
+    where = ["user_id = ?", "is_course = ?"]
+    where += [f"{field} {operator} ?" for field, operator in filters]
+
+    cursor_order = ()
+    if seek:
+        clause, cursor_order = _seek(keys, backwards)
+        where.append(clause)
+
+    flip = {"asc": "DESC", "desc": "ASC"}
+    order_by = [
+        f"{expression} {flip[direction] if backwards else direction.upper()}"
+        for expression, direction in keys
+    ]
+
+    sql = (
+        f"SELECT {', '.join(selected)} FROM courses "
+        f"WHERE {' AND '.join(where)} "
+        f"ORDER BY {', '.join(order_by)}"
+    )
+    if limited:
+        sql += " LIMIT ?"
+    return sql, cursor_order
+
+
+def build(spec, user_id, cursor=None, backwards=False):
+    """
+    Return (sql, params) listing `user_id`'s entries for `spec`.
+
+    `cursor` holds the sort key values and id of the row to resume after,
+    or before if `backwards` is set, in which case rows come back in reverse
+    order. Each row is the COLUMNS followed by its sort key values.
+    """
+    seek = None
+    if cursor is not None:
+        seek = "before" if backwards else "after"
+
+    filter_shape = tuple((field, operator) for field, operator, _ in spec.filters)
+    sql, cursor_order = _compile(filter_shape, spec.sort, spec.limit is not None, seek)
+
+    params = [user_id, spec.is_course]
+    params += [value for _, _, value in spec.filters]
+    params += [cursor[i] for i in cursor_order]
+    if spec.limit is not None:
+        params.append(spec.limit)
+    return sql, tuple(params)
+
+
+def encode_cursor(row):
+    """Opaque token for a listed row's position: its sort key values and id."""
+    position = list(row[len(COLUMNS):]) + [row[0]]
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip("=")
+
+
+def decode_cursor(token, spec):
+    """Position encoded by encode_cursor, or None if the token isn't valid for `spec`."""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except (ValueError, TypeError):
+        return None
+
+    if not isinstance(position, list) or len(position) != len(spec.sort) + 1:
+        return None
+    if not all(isinstance(value, (int, str)) and not isinstance(value, bool) for value in position):
+        return None
+    return tuple(position)
+
+
+@dataclass
+class Page:
+    rows: list
+    next_cursor: str = None
+    previous_cursor: str = None
+
+
+def paginate(db, spec, user_id, after=None, before=None):
+    """
+    Fetch one page of `spec.limit` rows after or before a cursor token.
+
+    Each page is a single index seek, so deep pages cost the same as the
+    first. Invalid cursors are treated as absent.
+    """
+    limit = spec.limit
+    spec = replace(spec, limit=limit + 1)
+
+    if before and (position := decode_cursor(before, spec)):
+        rows = db.execute(*build(spec, user_id, position, backwards=True)).fetchall()
+        if rows:
+            more = len(rows) > limit
+            rows = rows[:limit][::-1]
+            return Page(
+                rows,
+                next_cursor=encode_cursor(rows[-1]),
+                previous_cursor=encode_cursor(rows[0]) if more else None,
+            )
+        after = None
+
+    position = decode_cursor(after, spec) if after else None
+    rows = db.execute(*build(spec, user_id, position)).fetchall()
+    if position and not rows:
+        # Paged past the end, e.g. after entries were dropped
+        return paginate(db, replace(spec, limit=limit), user_id)
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return Page(
+        rows,
+        next_cursor=encode_cursor(rows[-1]) if more else None,
+        previous_cursor=encode_cursor(rows[0]) if position and rows else None,
+    )
@@ -0,0 +1,417 @@
+"""
+Numbered schema migrations for courses.db.
+
+The database's PRAGMA user_version records how many migrations have been
+applied. Migrations are only ever appended to MIGRATIONS, never edited once
+deployed. Each one is either an SQL script or a function taking the
+connection, and runs inside a single transaction together with the
+user_version bump, so a failed migration leaves the schema untouched.
+"""
+import sqlite3
+import sys
+
+import click
+from flask.cli import AppGroup
+
+from database import get_db
+
+
+def rebuild_table(conn, table, definition, columns):
+    """
+    Rebuild `table` with a new column `definition`, copying `columns` across.
+
+    Follows SQLite's recommended sequence for schema changes ALTER TABLE
+    can't make, and recreates the table's indexes and triggers afterwards.
+    Must be run inside the migration's transaction.
+    """
+    saved = conn.execute(
+        "SELECT sql FROM sqlite_master \
+        WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL",
+        (table,)
+    ).fetchall()
+
+    column_list = ", ".join(columns)
+    conn.execute(f"CREATE TABLE {table}_new {definition}")
+    conn.execute(f"INSERT INTO {table}_new ({column_list}) SELECT {column_list} FROM {table}")
+    conn.execute(f"DROP TABLE {table}")
+
+    # Keep triggers and views on other tables from being re-parsed mid-rename
+    conn.execute("PRAGMA legacy_alter_table = ON")
+    conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+    conn.execute("PRAGMA legacy_alter_table = OFF")
+
+    for (sql,) in saved:
+        conn.execute(sql)
+
+
+def _rebuild_courses_with_checks(conn):
+    """3: Declare the types courses actually stores, and enforce them"""
+    rebuild_table(
+        conn, "courses",
+        "(id INTEGER, user_id INTEGER NOT NULL, name TEXT NOT NULL, url TEXT, topics TEXT NOT NULL, desc TEXT NOT NULL, provider TEXT NOT NULL, is_complete INTEGER NOT NULL CHECK (is_complete IN (0, 1, 2)), is_course INTEGER NOT NULL CHECK (is_course IN (0, 1)), PRIMARY KEY(id), UNIQUE(user_id, name))",
+        ["id", "user_id", "name", "url", "topics", "desc", "provider", "is_complete", "is_course"],
+    )
+
+
+def _normalize_topics(conn):
+    """5: Store each topic once and link it to courses, backfilled from courses.topics"""
+    for statement in _statements("""
+        CREATE TABLE topics (id INTEGER, key TEXT NOT NULL UNIQUE, label TEXT NOT NULL, PRIMARY KEY(id));
+        CREATE TABLE course_topics (course_id INTEGER NOT NULL REFERENCES courses(id), topic_id INTEGER NOT NULL REFERENCES topics(id), PRIMARY KEY(course_id, topic_id)) WITHOUT ROWID;
+        CREATE INDEX course_topics_topic ON course_topics (topic_id);
+        CREATE TRIGGER courses_delete_topics AFTER DELETE ON courses BEGIN
+            DELETE FROM course_topics WHERE course_id = old.id;
+        END;
+    """):
+        conn.execute(statement)
+
+    # Backfill with a copy of what topics.link_topics did at the time, so
+    # later changes to it don't change this migration
+    links = []
+    for course_id, text in conn.execute("SELECT id, topics FROM courses").fetchall():
+        keys = set()
+        for part in text.split(","):
+            label = " ".join(part.split())
+            key = label.casefold()
+            if label and key not in keys:
+                keys.add(key)
+                links.append((course_id, key, label))
+
+    conn.executemany(
+        "INSERT INTO topics (key, label) VALUES (?, ?) ON CONFLICT (key) DO NOTHING",
+        [(key, label) for _, key, label in links]
+    )
+    conn.executemany(
+        "INSERT INTO course_topics (course_id, topic_id) SELECT ?, id FROM topics WHERE key = ?",
+        [(course_id, key) for course_id, key, _ in links]
+    )
+
+
+def _label_topics_per_user(conn):
+    """12: Keep each course's own spelling of its topics, and each user's in their skill counts"""
+    conn.execute("ALTER TABLE course_topics ADD COLUMN label TEXT")
+    conn.execute("ALTER TABLE user_skill_counts ADD COLUMN label TEXT")
+
+    # Split courses.topics as topics.split_topics did at the time
+    labels = []
+    for course_id, text in conn.execute("SELECT id, topics FROM courses").fetchall():
+        keys = set()
+        for part in text.split(","):
+            label = " ".join(part.split())
+            key = label.casefold()
+            if label and key not in keys:
+                keys.add(key)
+                labels.append((label, course_id, key))
+    conn.executemany(
+        "UPDATE course_topics SET label = ? \
+        WHERE course_id = ? AND topic_id = (SELECT id FROM topics WHERE key = ?)",
+        labels
+    )
+
+    for statement in _statements("""
+        UPDATE course_topics SET label = (SELECT label FROM topics WHERE id = topic_id) WHERE label IS NULL;
+
+        UPDATE user_skill_counts SET label = (
+            SELECT MIN(course_topics.label) FROM courses
+            JOIN course_topics ON course_topics.course_id = courses.id
+            WHERE courses.user_id = user_skill_counts.user_id AND courses.is_complete = 2
+            AND course_topics.topic_id = user_skill_counts.topic_id
+        );
+
+        DROP TRIGGER course_topics_count_insert;
+        CREATE TRIGGER course_topics_count_insert AFTER INSERT ON course_topics BEGIN
+            INSERT INTO user_skill_counts (user_id, topic_id, count, label)
+                SELECT user_id, new.topic_id, 1, new.label FROM courses WHERE id = new.course_id AND is_complete = 2
+                ON CONFLICT (user_id, topic_id) DO UPDATE SET count = count + 1;
+        END;
+
+        DROP TRIGGER courses_count_complete;
+        CREATE TRIGGER courses_count_complete AFTER UPDATE OF is_complete ON courses
+        WHEN (old.is_complete = 2) != (new.is_complete = 2) BEGIN
+            INSERT INTO user_skill_counts (user_id, topic_id, count, label)
+                SELECT new.user_id, topic_id, 1, label FROM course_topics WHERE course_id = new.id AND new.is_complete = 2
+                ON CONFLICT (user_id, topic_id) DO UPDATE SET count = count + 1;
+            UPDATE user_skill_counts SET count = count - 1
+                WHERE old.is_complete = 2 AND user_id = old.user_id
+                AND topic_id IN (SELECT topic_id FROM course_topics WHERE course_id = old.id);
+            DELETE FROM user_skill_counts WHERE user_id = old.user_id AND count <= 0;
+        END;
+    """):
+        conn.execute(statement)
+
+
+MIGRATIONS = [
+    # 1: Baseline schema, as deployed before migrations were tracked
+    """
+    CREATE TABLE IF NOT EXISTS users (id INTEGER, username TEXT NOT NULL UNIQUE, hash TEXT NOT NULL, PRIMARY KEY(id));
+    CREATE TABLE IF NOT EXISTS courses (id INTEGER, user_id INTEGER NOT NULL, name TEXT NOT NULL UNIQUE, url TEXT, topics TEXT NOT NULL, desc TEXT NOT NULL, provider TEXT NOT NULL, is_complete INTEGER NOT NULL, is_course BOOL NOT NULL, PRIMARY KEY(id));
+    """,
+
+    # 2: Course names are unique per user, and listings are indexed by user
+    """
+    CREATE TABLE courses_new (id INTEGER, user_id INTEGER NOT NULL, name TEXT NOT NULL, url TEXT, topics TEXT NOT NULL, desc TEXT NOT NULL, provider TEXT NOT NULL, is_complete INTEGER NOT NULL, is_course BOOL NOT NULL, PRIMARY KEY(id), UNIQUE(user_id, name));
+    INSERT INTO courses_new (id, user_id, name, url, topics, desc, provider, is_complete, is_course)
+        SELECT id, user_id, name, url, topics, desc, provider, is_complete, is_course FROM courses;
+    DROP TABLE courses;
+    ALTER TABLE courses_new RENAME TO courses;
+    CREATE INDEX courses_user_course_name ON courses (user_id, is_course, name);
+    CREATE INDEX courses_user_complete ON courses (user_id, is_complete);
+    """,
+
+    _rebuild_courses_with_checks,
+
+    # 4: Every listing sort reads in index order (see listing.SORT_KEYS)
+    """
+    CREATE INDEX courses_user_course_provider ON courses (user_id, is_course, provider, name);
+    CREATE INDEX courses_user_course_complete ON courses (user_id, is_course, is_complete, name);
+    CREATE INDEX courses_user_course_completed_first ON courses (user_id, is_course, 2 - is_complete, name);
+    CREATE INDEX courses_user_course_in_progress_first ON courses (user_id, is_course, CASE is_complete WHEN 1 THEN 0 WHEN 2 THEN 1 ELSE 2 END, name);
+    """,
+
+    _normalize_topics,
+
+    # 6: Completed entries per user and topic, maintained by triggers
+    """
+    CREATE TABLE user_skill_counts (user_id INTEGER NOT NULL, topic_id INTEGER NOT NULL REFERENCES topics(id), count INTEGER NOT NULL, PRIMARY KEY(user_id, topic_id)) WITHOUT ROWID;
+
+    CREATE TRIGGER course_topics_count_insert AFTER INSERT ON course_topics BEGIN
+        INSERT INTO user_skill_counts (user_id, topic_id, count)
+            SELECT user_id, new.topic_id, 1 FROM courses WHERE id = new.course_id AND is_complete = 2
+            ON CONFLICT (user_id, topic_id) DO UPDATE SET count = count + 1;
+    END;
+
+    CREATE TRIGGER course_topics_count_delete AFTER DELETE ON course_topics BEGIN
+        UPDATE user_skill_counts SET count = count - 1
+            WHERE topic_id = old.topic_id
+            AND user_id = (SELECT user_id FROM courses WHERE id = old.course_id AND is_complete = 2);
+        DELETE FROM user_skill_counts WHERE topic_id = old.topic_id AND count <= 0;
+    END;
+
+    CREATE TRIGGER courses_count_complete AFTER UPDATE OF is_complete ON courses
+    WHEN (old.is_complete = 2) != (new.is_complete = 2) BEGIN
+        INSERT INTO user_skill_counts (user_id, topic_id, count)
+            SELECT new.user_id, topic_id, 1 FROM course_topics WHERE course_id = new.id AND new.is_complete = 2
+            ON CONFLICT (user_id, topic_id) DO UPDATE SET count = count + 1;
+        UPDATE user_skill_counts SET count = count - 1
+            WHERE old.is_complete = 2 AND user_id = old.user_id
+            AND topic_id IN (SELECT topic_id FROM course_topics WHERE course_id = old.id);
+        DELETE FROM user_skill_counts WHERE user_id = old.user_id AND count <= 0;
+    END;
+
+    -- Runs before courses_delete_topics unlinks the entry, while it still exists
+    CREATE TRIGGER courses_count_delete BEFORE DELETE ON courses WHEN old.is_complete = 2 BEGIN
+        UPDATE user_skill_counts SET count = count - 1
+            WHERE user_id = old.user_id
+            AND topic_id IN (SELECT topic_id FROM course_topics WHERE course_id = old.id);
+        DELETE FROM user_skill_counts WHERE user_id = old.user_id AND count <= 0;
+    END;
+
+    INSERT INTO user_skill_counts (user_id, topic_id, count)
+        SELECT courses.user_id, course_topics.topic_id, COUNT(*) FROM courses
+        JOIN course_topics ON course_topics.course_id = courses.id
+        WHERE courses.is_complete = 2
+        GROUP BY courses.user_id, course_topics.topic_id;
+    """,
+
+    # 7: Per-user data version, bumped by every write to a user's entries
+    """
+    CREATE TABLE user_versions (user_id INTEGER, version INTEGER NOT NULL, PRIMARY KEY(user_id));
+
+    CREATE TRIGGER courses_version_insert AFTER INSERT ON courses BEGIN
+        INSERT INTO user_versions (user_id, version) VALUES (new.user_id, 1)
+            ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+    END;
+
+    CREATE TRIGGER courses_version_update AFTER UPDATE ON courses BEGIN
+        INSERT INTO user_versions (user_id, version) VALUES (new.user_id, 1)
+            ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+    END;
+
+    CREATE TRIGGER courses_version_delete AFTER DELETE ON courses BEGIN
+        INSERT INTO user_versions (user_id, version) VALUES (old.user_id, 1)
+            ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+    END;
+    """,
+
+    # 8: Server-side sessions (see sessions.py)
+    """
+    CREATE TABLE sessions (id TEXT NOT NULL, data TEXT NOT NULL, expires_at INTEGER NOT NULL, PRIMARY KEY(id)) WITHOUT ROWID;
+    CREATE INDEX sessions_expires ON sessions (expires_at);
+    """,
+
+    # 9: Login rate limit buckets shared between workers (see ratelimit.py)
+    """
+    CREATE TABLE login_buckets (key TEXT NOT NULL, tokens REAL NOT NULL, updated_at REAL NOT NULL, PRIMARY KEY(key)) WITHOUT ROWID;
+    CREATE INDEX login_buckets_updated ON login_buckets (updated_at);
+    """,
+
+    # 10: Full-text search over courses (see search.py). The owner column
+    # holds a token per user, so a search only visits that user's entries.
+    """
+    CREATE VIEW courses_search_source AS
+        SELECT id, name, desc, topics, provider, 'user' || user_id AS owner FROM courses;
+
+    CREATE VIRTUAL TABLE courses_search USING fts5(
+        name, desc, topics, provider, owner,
+        content='courses_search_source', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    );
+
+    CREATE TRIGGER courses_search_insert AFTER INSERT ON courses BEGIN
+        INSERT INTO courses_search (rowid, name, desc, topics, provider, owner)
+            VALUES (new.id, new.name, new.desc, new.topics, new.provider, 'user' || new.user_id);
+    END;
+
+    CREATE TRIGGER courses_search_delete AFTER DELETE ON courses BEGIN
+        INSERT INTO courses_search (courses_search, rowid, name, desc, topics, provider, owner)
+            VALUES ('delete', old.id, old.name, old.desc, old.topics, old.provider, 'user' || old.user_id);
+    END;
+
+    CREATE TRIGGER courses_search_update AFTER UPDATE OF name, desc, topics, provider, user_id ON courses BEGIN
+        INSERT INTO courses_search (courses_search, rowid, name, desc, topics, provider, owner)
+            VALUES ('delete', old.id, old.name, old.desc, old.topics, old.provider, 'user' || old.user_id);
+        INSERT INTO courses_search (rowid, name, desc, topics, provider, owner)
+            VALUES (new.id, new.name, new.desc, new.topics, new.provider, 'user' || new.user_id);
+    END;
+
+    INSERT INTO courses_search (courses_search) VALUES ('rebuild');
+    """,
+
+    # 11: Let a bulk import index its rows in one statement rather than a
+    # row at a time (see search.bulk_indexing). courses_search_paused only
+    # ever has rows inside the importing transaction.
+    """
+    CREATE TABLE courses_search_paused (user_id INTEGER, PRIMARY KEY(user_id));
+
+    DROP TRIGGER courses_search_insert;
+    CREATE TRIGGER courses_search_insert AFTER INSERT ON courses
+    WHEN NOT EXISTS (SELECT 1 FROM courses_search_paused WHERE user_id = new.user_id) BEGIN
+        INSERT INTO courses_search (rowid, name, desc, topics, provider, owner)
+            VALUES (new.id, new.name, new.desc, new.topics, new.provider, 'user' || new.user_id);
+    END;
+    """,
+    # 12: Show each user their own spelling of a topic; topics.label is just
+    # whichever spelling was seen first, by any user
+    _label_topics_per_user,
+]
+
+
+def _statements(script):
+    """Split an SQL script into complete statements."""
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            yield statement.strip()
+            statement = ""
+    if statement.strip():
+        raise ValueError(f"Incomplete SQL statement in migration: {statement.strip()}")
+
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def latest_version():
+    return len(MIGRATIONS)
+
+
+def apply(conn, number):
+    """
+    Apply migration `number` and record it, all in one transaction.
+
+    Returns False, changing nothing, if another process applied it first.
+    """
+    migration = MIGRATIONS[number - 1]
+
+    conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Read again under the write lock: the version seen before taking it
+        # may be stale if several workers are starting up at once
+        if current_version(conn) >= number:
+            conn.rollback()
+            return False
+
+        if callable(migration):
+            migration(conn)
+        else:
+            for statement in _statements(migration):
+                conn.execute(statement)
+
+        problems = conn.execute("PRAGMA foreign_key_check").fetchall()
+        if problems:
+            raise sqlite3.IntegrityError(f"Migration {number} broke foreign keys: {problems}")
+
+        conn.execute(f"PRAGMA user_version = {number}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return True
+
+
+def upgrade(conn, target=None):
+    """Apply every migration newer than the database's user_version."""
+    target = latest_version() if target is None else target
+    applied = []
+
+    for number in range(current_version(conn) + 1, target + 1):
+        if apply(conn, number):
+            applied.append(number)
+
+    return applied
+
+
+db_cli = AppGroup("db", help="Manage the courses.db schema.")
+
+
+@db_cli.command("upgrade")
+@click.option("--target", type=int, help="Stop after this migration number.")
+def upgrade_command(target):
+    """Apply outstanding migrations."""
+    applied = upgrade(get_db(), target)
+    if applied:
+        click.echo(f"Applied migrations {', '.join(map(str, applied))}.")
+    else:
+        click.echo("Schema is already up to date.")
+
+
+@db_cli.command("version")
+def version_command():
+    """Show the applied and latest migration numbers."""
+    click.echo(f"Schema version {current_version(get_db())} of {latest_version()}.")
+
+
+def _cli_command():
+    """Name of the `flask` command the app is being loaded for, if any."""
+    ctx = click.get_current_context(silent=True)
+    if ctx is None:
+        return None
+
+    # Click has already consumed the arguments, so find the command the
+    # way it did: the first one that isn't an option or an option's value
+    takes_value = {
+        opt
+        for param in ctx.command.params
+        if isinstance(param, click.Option) and not param.is_flag
+        for opt in param.opts
+    }
+    args = iter(sys.argv[1:])
+    for arg in args:
+        if not arg.startswith("-"):
+            return arg
+        if arg in takes_value:
+            next(args, None)
+    return None
+
+
+def init_migrations(app):
+    app.config.setdefault("MIGRATE_ON_STARTUP", True)
+    app.cli.add_command(db_cli)
+
+    # `flask db` is there to inspect and control outstanding migrations,
+    # so it mustn't find them already applied (or fail to load over one)
+    if app.config["MIGRATE_ON_STARTUP"] and _cli_command() != db_cli.name:
+        with app.app_context():
+            upgrade(get_db())
@@ -0,0 +1,258 @@
+"""
+Password hashing off the request threads.
+
+Password hashes are deliberately slow to compute, so they run in a small
+pool of worker processes instead of on the threads serving listings. At
+most PASSWORD_POOL_QUEUE hashes wait for a free worker; past that, callers
+get HasherBusy straight away and the client is told to retry later, rather
+than queueing work that would only time out.
+
+New hashes use PASSWORD_HASH_METHOD. A login whose stored hash was made
+with any other method rehashes the password in the background, so the
+cost can be tuned (see `flask bench kdf`) without forcing password resets.
+"""
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import current_app
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+from database import get_pool
+
+
+class HasherBusy(Exception):
+    """Raised when the hashing pool can't take on or finish a hash in time."""
+
+
+def canonical_method(method):
+    """
+    Spell out a werkzeug hash method with all of its parameters, as it is
+    recorded at the start of the hashes it makes.
+    """
+    name, *args = method.split(":")
+    if name == "scrypt":
+        n, r, p = args or (2**15, 8, 1)
+        return f"scrypt:{int(n)}:{int(r)}:{int(p)}"
+    if name == "pbkdf2":
+        hash_name = args[0] if args else "sha256"
+        iterations = args[1] if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f"pbkdf2:{hash_name}:{int(iterations)}"
+    raise ValueError(f"Unsupported password hash method: {method}")
+
+
+def needs_rehash(pwhash, method):
+    """Whether `pwhash` was made with anything other than `method`."""
+    return pwhash.split("$", 1)[0] != canonical_method(method)
+
+
+def _timed(function, *args):
+    """Run `function` in a worker, returning its result and how long it took."""
+    started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started
+
+
+class PasswordHasher:
+    """
+    Bounded process pool for password hashes.
+
+    `workers` processes hash in parallel and up to `max_queue` more hashes
+    may wait for one. A `workers` of 0 hashes inline on the calling thread.
+    """
+
+    def __init__(self, workers=2, max_queue=8, timeout=10, method="scrypt"):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.method = canonical_method(method)
+
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+
+        self.hashes = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.hash_time = 0.0
+        self.wait_time = 0.0
+        self.max_latency = 0.0
+        self.rehashed = 0
+        self.rehashes_skipped = 0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # Spawned, not forked: forking a threaded server can copy
+                # locks held by other threads into the workers
+                self._executor = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def _finished(self, future):
+        with self._lock:
+            self._pending -= 1
+
+    def _record(self, latency, elapsed):
+        with self._lock:
+            self.hashes += 1
+            self.hash_time += elapsed
+            self.wait_time += latency - elapsed
+            self.max_latency = max(self.max_latency, latency)
+
+    def _submit(self, function, *args):
+        """Queue `function` on a worker, returning a future of (result, elapsed)."""
+        if not self.workers:
+            future = Future()
+            future.set_result(_timed(function, *args))
+            return future
+
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise HasherBusy("Too many password hashes waiting.")
+            self._pending += 1
+
+        executor = self._get_executor()
+        try:
+            future = executor.submit(_timed, function, *args)
+        except BrokenProcessPool:
+            with self._lock:
+                self._pending -= 1
+                # Start a fresh pool on the next hash
+                if self._executor is executor:
+                    self._executor = None
+            raise HasherBusy("Password hashing pool restarting.")
+        # The slot stays taken until the worker is done, even if we stop waiting
+        future.add_done_callback(self._finished)
+        return future
+
+    def _run(self, function, *args):
+        started = time.perf_counter()
+        future = self._submit(function, *args)
+        try:
+            result, elapsed = future.result(timeout=self.timeout)
+        except TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise HasherBusy(f"No password hash finished after {self.timeout}s.")
+        except BrokenProcessPool:
+            with self._lock:
+                self._executor = None
+            raise HasherBusy("Password hashing pool restarting.")
+
+        self._record(time.perf_counter() - started, elapsed)
+        return result
+
+    def generate(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def check(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def rehash_later(self, app, user_id, old_hash, password):
+        """
+        Replace `user_id`'s `old_hash` with one made by the current method,
+        without waiting for it.
+
+        Skipped while the pool is busy, as the next login will try again. The
+        new hash is only stored if the old one is still current, so a password
+        changed in the meantime is never overwritten.
+        """
+        try:
+            future = self._submit(generate_password_hash, password, self.method)
+        except HasherBusy:
+            with self._lock:
+                self.rehashes_skipped += 1
+            return
+
+        def store(future):
+            try:
+                new_hash, _ = future.result()
+            except Exception:
+                with self._lock:
+                    self.rehashes_skipped += 1
+                return
+
+            pool = get_pool(app)
+            conn = pool.acquire()
+            try:
+                updated = conn.execute(
+                    "UPDATE users SET hash = ? WHERE id = ? AND hash = ?",
+                    (new_hash, user_id, old_hash,)
+                ).rowcount
+                conn.commit()
+            except Exception:
+                app.logger.exception("Password rehash failed")
+                updated = 0
+            finally:
+                pool.release(conn)
+
+            with self._lock:
+                if updated:
+                    self.rehashed += 1
+                else:
+                    self.rehashes_skipped += 1
+
+        # Store from a thread of its own rather than the pool's callback thread
+        future.add_done_callback(lambda future: threading.Thread(target=store, args=(future,)).start())
+
+    def stats(self):
+        with self._lock:
+            return {
+                "method": self.method,
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "pending": self._pending,
+                "queue_depth": max(0, self._pending - self.workers),
+                "hashes": self.hashes,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "hash_time": round(self.hash_time, 6),
+                "wait_time": round(self.wait_time, 6),
+                "max_latency": round(self.max_latency, 6),
+                "rehashed": self.rehashed,
+                "rehashes_skipped": self.rehashes_skipped,
+            }
+
+
+def get_hasher(app=None):
+    app = app or current_app
+    return app.extensions["password_hasher"]
+
+
+def hash_password(password):
+    """Hash a new password, raising HasherBusy if the pool is saturated."""
+    return get_hasher().generate(password)
+
+
+def verify_password(pwhash, password, user_id=None):
+    """
+    Check `password` against `pwhash`, raising HasherBusy if the pool is saturated.
+
+    If it matches and `user_id` is given, a hash made with an outdated method
+    is upgraded in the background.
+    """
+    hasher = get_hasher()
+    if not hasher.check(pwhash, password):
+        return False
+    if user_id is not None and needs_rehash(pwhash, hasher.method):
+        hasher.rehash_later(current_app._get_current_object(), user_id, pwhash, password)
+    return True
+
+
+def init_passwords(app):
+    app.config.setdefault("PASSWORD_POOL_SIZE", 2)
+    app.config.setdefault("PASSWORD_POOL_QUEUE", 8)
+    app.config.setdefault("PASSWORD_POOL_TIMEOUT", 10)
+    app.config.setdefault("PASSWORD_RETRY_AFTER", 5)
+    app.config.setdefault("PASSWORD_HASH_METHOD", "scrypt")
+    app.extensions["password_hasher"] = PasswordHasher(
+        app.config["PASSWORD_POOL_SIZE"],
+        app.config["PASSWORD_POOL_QUEUE"],
+        app.config["PASSWORD_POOL_TIMEOUT"],
+        app.config["PASSWORD_HASH_METHOD"],
+    )
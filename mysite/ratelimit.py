@@ -0,0 +1,173 @@
+"""
+Login rate limiting.
+
+Each login attempt takes a token from two buckets, one for the username and
+one for the client's address. Buckets hold up to LOGIN_LIMIT_BURST tokens
+and refill at LOGIN_LIMIT_PER_MINUTE. An attempt that finds either bucket
+empty is turned away before its password is hashed, so a brute-force run
+costs a lookup instead of a hash.
+
+Buckets are kept in memory, bounded to LOGIN_LIMIT_MAX_KEYS by forgetting
+the least recently used, or with LOGIN_LIMIT_STORE = "sqlite" in the
+login_buckets table, so that every worker process shares them.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+from database import get_db
+
+
+class RateLimited(Exception):
+    """Raised when a login attempt is over the limit."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Too many login attempts, retry in {retry_after}s.")
+        self.retry_after = retry_after
+
+
+class MemoryBuckets:
+    """Token buckets for this process, evicting the least recently used."""
+
+    def __init__(self, burst, rate, max_keys=10000):
+        self.burst = burst
+        self.rate = rate
+        self.max_keys = max_keys
+
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def take(self, key, now):
+        """Take a token from `key`'s bucket, returning 0 or the seconds until one is free."""
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            wait = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+
+            # An evicted bucket has been idle the longest, so is likely full anyway
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+                self.evictions += 1
+        return wait
+
+    def stats(self):
+        with self._lock:
+            return {"keys": len(self._buckets), "evictions": self.evictions}
+
+
+class SQLiteBuckets:
+    """Token buckets in the login_buckets table, shared by every worker."""
+
+    # Attempts between sweeps for buckets that have refilled
+    PRUNE_EVERY = 1000
+
+    def __init__(self, burst, rate):
+        self.burst = burst
+        self.rate = rate
+
+        self._lock = threading.Lock()
+        self._takes = 0
+        self.evictions = 0
+
+    def take(self, key, now):
+        """Take a token from `key`'s bucket, returning 0 or the seconds until one is free."""
+        db = get_db()
+        # Refills and takes in one statement, so concurrent workers can't
+        # both spend the last token
+        taken = db.execute(
+            "INSERT INTO login_buckets (key, tokens, updated_at) VALUES (?, ?, ?) \
+            ON CONFLICT (key) DO UPDATE SET \
+                tokens = MIN(?, tokens + (excluded.updated_at - updated_at) * ?) - 1, \
+                updated_at = excluded.updated_at \
+            WHERE MIN(?, tokens + (excluded.updated_at - updated_at) * ?) >= 1",
+            (key, self.burst - 1, now, self.burst, self.rate, self.burst, self.rate,)
+        ).rowcount
+        db.commit()
+
+        with self._lock:
+            self._takes += 1
+            prune = self._takes % self.PRUNE_EVERY == 0
+        if prune:
+            self.prune(db, now)
+
+        if taken:
+            return 0
+        tokens, updated_at = db.execute(
+            "SELECT tokens, updated_at FROM login_buckets WHERE key = ?", (key,)
+        ).fetchone()
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+        return max(0, (1 - tokens) / self.rate)
+
+    def prune(self, db, now):
+        """Forget buckets that have refilled completely."""
+        pruned = db.execute(
+            "DELETE FROM login_buckets WHERE updated_at < ?",
+            (now - self.burst / self.rate,)
+        ).rowcount
+        db.commit()
+        with self._lock:
+            self.evictions += pruned
+
+    def stats(self):
+        with self._lock:
+            return {"evictions": self.evictions}
+
+
+class LoginLimiter:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+
+        self.allowed = 0
+        self.hashes_avoided = 0
+
+    def check(self, username, address):
+        """Count a login attempt, raising RateLimited if it is over the limit."""
+        now = time.time()
+        wait = max(
+            self.buckets.take(f"user:{username}", now),
+            self.buckets.take(f"address:{address}", now),
+        )
+
+        with self._lock:
+            if wait:
+                self.hashes_avoided += 1
+            else:
+                self.allowed += 1
+        if wait:
+            raise RateLimited(max(1, math.ceil(wait)))
+
+    def stats(self):
+        with self._lock:
+            stats = {"allowed": self.allowed, "hashes_avoided": self.hashes_avoided}
+        stats.update(self.buckets.stats())
+        return stats
+
+
+def get_limiter(app=None):
+    app = app or current_app
+    return app.extensions["login_limiter"]
+
+
+def init_ratelimit(app):
+    app.config.setdefault("LOGIN_LIMIT_BURST", 10)
+    app.config.setdefault("LOGIN_LIMIT_PER_MINUTE", 5)
+    app.config.setdefault("LOGIN_LIMIT_MAX_KEYS", 10000)
+    app.config.setdefault("LOGIN_LIMIT_STORE", "memory")
+
+    burst = app.config["LOGIN_LIMIT_BURST"]
+    rate = app.config["LOGIN_LIMIT_PER_MINUTE"] / 60
+    if app.config["LOGIN_LIMIT_STORE"] == "sqlite":
+        buckets = SQLiteBuckets(burst, rate)
+    else:
+        buckets = MemoryBuckets(burst, rate, app.config["LOGIN_LIMIT_MAX_KEYS"])
+    app.extensions["login_limiter"] = LoginLimiter(buckets)
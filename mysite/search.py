@@ -0,0 +1,92 @@
+"""
+Full-text search over a user's courses and modules.
+
+courses_search is an FTS5 index of courses kept up to date by triggers.
+Searches are restricted to the user's `owner` token inside the index, so
+they cost the same however many other users there are.
+"""
+import re
+from contextlib import contextmanager
+
+from markupsafe import Markup, escape
+
+# Highest ranked results shown for a search
+SEARCH_LIMIT = 50
+
+# Marks matched terms in highlight() output; escaped before they become HTML
+START, END = "\x02", "\x03"
+
+# Columns a search looks in, and how much a match in each counts towards
+# the ranking (the owner column is only for filtering)
+WEIGHTS = {"name": 10.0, "desc": 1.0, "topics": 5.0, "provider": 2.0, "owner": 0.0}
+
+TERM = re.compile(r"\w+")
+
+
+def match_expression(text, user_id):
+    """
+    FTS5 query for entries of `user_id` with every word of `text`, each as a
+    prefix, or None if `text` has no words.
+    """
+    terms = TERM.findall(text)
+    if not terms:
+        return None
+    words = " AND ".join(f'"{term}"*' for term in terms)
+    return f"owner:user{int(user_id)} AND {{name desc topics provider}}: ({words})"
+
+
+def _markup(text):
+    """Escape highlight() output, turning its markers into <mark> tags."""
+    return Markup(
+        str(escape(text)).replace(START, "<mark>").replace(END, "</mark>")
+    )
+
+
+def find_entries(db, user_id, text, limit=SEARCH_LIMIT):
+    """
+    Best matches for `text` among `user_id`'s entries, as (id, name, desc,
+    topics, provider, url, is_complete, is_course), the text columns
+    highlighted and the description cut down to a snippet.
+    """
+    expression = match_expression(text, user_id)
+    if expression is None:
+        return []
+
+    rows = db.execute(
+        f"SELECT courses.id, \
+            highlight(courses_search, 0, char(2), char(3)), \
+            snippet(courses_search, 1, char(2), char(3), '…', 24), \
+            highlight(courses_search, 2, char(2), char(3)), \
+            highlight(courses_search, 3, char(2), char(3)), \
+            courses.url, courses.is_complete, courses.is_course \
+        FROM courses_search JOIN courses ON courses.id = courses_search.rowid \
+        WHERE courses_search MATCH ? \
+        ORDER BY bm25(courses_search, {', '.join(map(str, WEIGHTS.values()))}) \
+        LIMIT ?",
+        (expression, limit,)
+    ).fetchall()
+    return [
+        (id, _markup(name), _markup(desc), _markup(topics), _markup(provider), url, is_complete, is_course)
+        for id, name, desc, topics, provider, url, is_complete, is_course in rows
+    ]
+
+
+@contextmanager
+def bulk_indexing(db, user_id, first_id):
+    """
+    Index the entries `user_id` adds inside the block together at the end,
+    `first_id` being the lowest id they'll have, rather than one by one as
+    they are inserted; FTS5 writes out its pending changes after each
+    statement, which makes row at a time indexing of many rows slow.
+
+    Must be used inside a transaction holding the write lock.
+    """
+    db.execute("INSERT INTO courses_search_paused (user_id) VALUES (?)", (user_id,))
+    yield
+    db.execute("DELETE FROM courses_search_paused WHERE user_id = ?", (user_id,))
+    db.execute(
+        "INSERT INTO courses_search (rowid, name, desc, topics, provider, owner) \
+        SELECT id, name, desc, topics, provider, owner FROM courses_search_source \
+        WHERE id >= ? AND owner = 'user' || ?",
+        (first_id, user_id,)
+    )
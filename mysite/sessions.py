@@ -0,0 +1,361 @@
+"""
+Server-side sessions stored in the `sessions` table of courses.db.
+
+The cookie only carries a random session id. Each request does at most one
+primary key read to load the session, and a write only when the session
+has changed.
+
+In the opt-in "signed" mode, a session holding nothing but the user id lives
+entirely in a signed, time-limited cookie, so logged in requests need no
+session I/O at all. Anything more (e.g. flashed messages) spills over into
+the server-side store until it has been consumed.
+
+Expired sessions are removed by SessionSweeper, from a background thread or
+`flask sessions sweep`, never on the request path.
+"""
+import os
+import secrets
+import struct
+import threading
+import time
+
+import click
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from flask.cli import AppGroup
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from flask_session import Session
+from werkzeug.datastructures import CallbackDict
+
+from database import get_db
+
+
+class SQLiteSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.accessed = False
+        self.cleared = False
+
+    # Reads are tracked like Flask's cookie sessions, so responses that
+    # depend on the session can be marked as varying with the cookie
+    def __getitem__(self, key):
+        self.accessed = True
+        return super().__getitem__(key)
+
+    def __contains__(self, key):
+        self.accessed = True
+        return super().__contains__(key)
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return super().get(key, default)
+
+    def setdefault(self, key, default=None):
+        self.accessed = True
+        return super().setdefault(key, default)
+
+    def clear(self):
+        # Logging in or out starts a new session id, so an old one can't be reused
+        self.cleared = True
+        super().clear()
+
+
+class SQLiteSessionInterface(SessionInterface):
+    serializer = TaggedJSONSerializer()
+
+    def _generate_sid(self):
+        return secrets.token_urlsafe(32)
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            row = get_db().execute(
+                "SELECT data FROM sessions WHERE id = ? AND expires_at > ?",
+                (sid, int(time.time()),)
+            ).fetchone()
+            if row:
+                return SQLiteSession(self.serializer.loads(row[0]), sid=sid)
+        return SQLiteSession(sid=self._generate_sid(), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        # Keep caches from serving one visitor's page to another
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        if not session.modified or (session.new and not session):
+            return
+
+        db = get_db()
+        if not session.new and (session.cleared or not session):
+            db.execute("DELETE FROM sessions WHERE id = ?", (session.sid,))
+            session.sid = self._generate_sid()
+
+        if not session:
+            db.commit()
+            response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        db.execute(
+            "INSERT INTO sessions (id, data, expires_at) VALUES (?, ?, ?) \
+            ON CONFLICT (id) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at",
+            (session.sid, self.serializer.dumps(dict(session)), int(time.time() + lifetime),)
+        )
+        db.commit()
+
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+
+class SignedSessionInterface(SessionInterface):
+    """
+    Keep the user id in a signed cookie, and anything else server-side.
+
+    `keys` are tried newest last, so a key is rotated by appending its
+    replacement and dropping it once cookies signed with it have expired.
+    Signed cookies can't be revoked individually: dropping every old key
+    logs everyone out.
+    """
+
+    def __init__(self, store, keys):
+        self.store = store
+        self.signer = URLSafeTimedSerializer(keys, salt="user-id")
+
+    def get_signed_cookie_name(self, app):
+        return app.config["SESSION_SIGNED_COOKIE_NAME"]
+
+    def open_session(self, app, request):
+        if request.cookies.get(self.get_cookie_name(app)):
+            session = self.store.open_session(app, request)
+            if not session.new:
+                return session
+
+        token = request.cookies.get(self.get_signed_cookie_name(app))
+        if token:
+            try:
+                user_id = self.signer.loads(token, max_age=app.permanent_session_lifetime.total_seconds())
+                return SQLiteSession({"user_id": user_id}, sid=self.store._generate_sid(), new=True)
+            except BadSignature:
+                pass
+        return SQLiteSession(sid=self.store._generate_sid(), new=True)
+
+    def save_session(self, app, session, response):
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        if not session.modified:
+            return
+
+        name = self.get_signed_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if set(session) - {"user_id"}:
+            # Needs server-side state; the stored session carries the user id
+            self.store.save_session(app, session, response)
+            response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if not session.new:
+            # Back down to at most the user id: drop the server-side copy
+            db = get_db()
+            db.execute("DELETE FROM sessions WHERE id = ?", (session.sid,))
+            db.commit()
+            response.delete_cookie(self.get_cookie_name(app), domain=domain, path=path)
+
+        if "user_id" in session:
+            response.set_cookie(
+                name,
+                self.signer.dumps(session["user_id"]),
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+        else:
+            response.delete_cookie(name, domain=domain, path=path)
+
+
+def _sweep_table(db, batch_size):
+    """Delete expired rows from sessions, committing after each batch."""
+    now = int(time.time())
+    expired = 0
+    while True:
+        deleted = db.execute(
+            "DELETE FROM sessions WHERE id IN \
+            (SELECT id FROM sessions WHERE expires_at <= ? LIMIT ?)",
+            (now, batch_size,)
+        ).rowcount
+        db.commit()
+        expired += deleted
+        if deleted < batch_size:
+            break
+    live = db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+    return expired, live
+
+
+def _sweep_files(directory, max_age, batch_size):
+    """
+    Delete Flask-Session files that have expired or are older than `max_age`.
+
+    Files are visited through one streaming directory scan, pausing between
+    batches so the sweep doesn't monopolise the disk.
+    """
+    now = time.time()
+    expired = live = 0
+    try:
+        entries = os.scandir(directory)
+    except FileNotFoundError:
+        return 0, 0
+
+    with entries:
+        for i, entry in enumerate(entries, start=1):
+            # Skip cachelib's bookkeeping files
+            if entry.name.startswith("__") or not entry.is_file():
+                continue
+            try:
+                with open(entry.path, "rb") as f:
+                    # cachelib stores the expiry time in the first 4 bytes (0 = never)
+                    expires = struct.unpack("I", f.read(4))[0]
+                stale = (expires and expires <= now) or entry.stat().st_mtime + max_age <= now
+                if stale:
+                    os.remove(entry.path)
+                    expired += 1
+                else:
+                    live += 1
+            except (OSError, struct.error):
+                continue
+            if i % batch_size == 0:
+                time.sleep(0.01)
+    return expired, live
+
+
+class SessionSweeper:
+    """Expires stale sessions in batches and keeps track of how many are live."""
+
+    def __init__(self, app):
+        self.app = app
+        self._lock = threading.Lock()
+
+        self.sweeps = 0
+        self.expired = 0
+        self.live = 0
+        self.high_water_mark = 0
+        self.last_sweep = None
+
+    def sweep(self):
+        """Run one sweep of the configured session store, returning how many expired."""
+        config = self.app.config
+        batch_size = config["SESSION_SWEEP_BATCH"]
+
+        if config["SESSION_TYPE"] in ("sqlite", "signed"):
+            expired, live = _sweep_table(get_db(), batch_size)
+        elif config["SESSION_TYPE"] == "filesystem":
+            directory = config.get("SESSION_FILE_DIR", os.path.join(os.getcwd(), "flask_session"))
+            max_age = self.app.permanent_session_lifetime.total_seconds()
+            expired, live = _sweep_files(directory, max_age, batch_size)
+        else:
+            return 0
+
+        with self._lock:
+            self.sweeps += 1
+            self.expired += expired
+            self.live = live
+            self.high_water_mark = max(self.high_water_mark, live + expired)
+            self.last_sweep = time.time()
+        return expired
+
+    def start(self, interval):
+        """Sweep every `interval` seconds on a daemon thread."""
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    with self.app.app_context():
+                        self.sweep()
+                except Exception:
+                    self.app.logger.exception("Session sweep failed")
+
+        threading.Thread(target=run, name="session-sweeper", daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sweeps": self.sweeps,
+                "expired": self.expired,
+                "live": self.live,
+                "high_water_mark": self.high_water_mark,
+                "last_sweep": self.last_sweep,
+            }
+
+
+def get_sweeper(app=None):
+    app = app or current_app
+    return app.extensions["session_sweeper"]
+
+
+sessions_cli = AppGroup("sessions", help="Maintain the session store.")
+
+
+@sessions_cli.command("sweep")
+def sweep_command():
+    """Delete expired sessions."""
+    sweeper = get_sweeper()
+    expired = sweeper.sweep()
+    click.echo(f"Expired {expired} sessions, {sweeper.live} still live.")
+
+
+def signing_keys(app):
+    keys = app.config["SESSION_SIGNING_KEYS"] or [app.secret_key]
+    if not all(keys):
+        raise RuntimeError('SESSION_TYPE = "signed" needs SECRET_KEY or SESSION_SIGNING_KEYS to be set.')
+    return keys
+
+
+def init_sessions(app):
+    """
+    Use the session store named by SESSION_TYPE: "sqlite", "signed" (signed
+    cookie backed by "sqlite"), or any Flask-Session type.
+    """
+    app.config.setdefault("SESSION_SWEEP_INTERVAL", 0)
+    app.config.setdefault("SESSION_SWEEP_BATCH", 500)
+    app.config.setdefault("SESSION_SIGNING_KEYS", [])
+    app.config.setdefault("SESSION_SIGNED_COOKIE_NAME", "uid")
+
+    if app.config["SESSION_TYPE"] == "sqlite":
+        app.session_interface = SQLiteSessionInterface()
+    elif app.config["SESSION_TYPE"] == "signed":
+        app.session_interface = SignedSessionInterface(SQLiteSessionInterface(), signing_keys(app))
+    else:
+        # Expiry is left to the sweeper, so cachelib never lists the
+        # session directory while handling a request
+        app.config.setdefault("SESSION_FILE_THRESHOLD", 0)
+        Session(app)
+
+    app.extensions["session_sweeper"] = SessionSweeper(app)
+    app.cli.add_command(sessions_cli)
+
+    if app.config["SESSION_SWEEP_INTERVAL"]:
+        app.extensions["session_sweeper"].start(app.config["SESSION_SWEEP_INTERVAL"])
@@ -0,0 +1,45 @@
+// Fills the datalist of each input marked data-autocomplete="field" with
+// suggestions from /autocomplete as the user types. For the comma separated
+// topics field, only the topic being typed is completed.
+document.querySelectorAll("[data-autocomplete]").forEach(function (input) {
+    const field = input.dataset.autocomplete;
+    const list = document.getElementById(input.getAttribute("list"));
+    let pending = null;
+
+    input.addEventListener("input", function () {
+        let head = "";
+        let prefix = input.value;
+        if (field === "topics") {
+            const comma = prefix.lastIndexOf(",");
+            head = prefix.slice(0, comma + 1);
+            prefix = prefix.slice(comma + 1);
+            if (head) {
+                head += " ";
+            }
+        }
+        prefix = prefix.trim();
+
+        if (pending) {
+            pending.abort();
+        }
+        if (!prefix) {
+            list.replaceChildren();
+            return;
+        }
+
+        pending = new AbortController();
+        const url = "/autocomplete?" + new URLSearchParams({field: field, q: prefix});
+        fetch(url, {signal: pending.signal})
+            .then(function (response) {
+                return response.json();
+            })
+            .then(function (data) {
+                list.replaceChildren(...data.suggestions.map(function (suggestion) {
+                    const option = document.createElement("option");
+                    option.value = head + suggestion;
+                    return option;
+                }));
+            })
+            .catch(function () {});
+    });
+});
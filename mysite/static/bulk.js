@@ -0,0 +1,10 @@
+// Ticks or clears every checkbox named by a data-select-all checkbox
+document.addEventListener("change", function (event) {
+    const name = event.target.getAttribute("data-select-all");
+    if (!name) {
+        return;
+    }
+    for (const box of event.target.form.querySelectorAll(`input[name="${name}"]`)) {
+        box.checked = event.target.checked;
+    }
+});
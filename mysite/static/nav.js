@@ -0,0 +1,11 @@
+// Opens and closes the collapsed navbar, in place of Bootstrap's script bundle
+document.addEventListener("click", function (event) {
+    const toggle = event.target.closest('[data-bs-toggle="collapse"]');
+    if (!toggle) {
+        return;
+    }
+    const target = document.querySelector(toggle.getAttribute("data-bs-target"));
+    const open = target.classList.toggle("show");
+    toggle.classList.toggle("collapsed", !open);
+    toggle.setAttribute("aria-expanded", open);
+});
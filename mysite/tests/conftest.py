@@ -0,0 +1,44 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# app.py configures itself on import, so point it at a scratch database first
+os.environ.setdefault("COURSES_DATABASE", os.path.join(tempfile.mkdtemp(), "courses.db"))
+os.environ.setdefault("SECRET_KEY", "test")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def app():
+    from app import app
+    app.config["TESTING"] = True
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def user_client(app):
+    """A client logged in as a user with one course."""
+    from database import get_db
+
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT OR IGNORE INTO users (username, hash) VALUES ('headers', 'unused')")
+        user_id = db.execute("SELECT id FROM users WHERE username = 'headers'").fetchone()[0]
+        db.execute(
+            "INSERT OR IGNORE INTO courses (user_id, name, topics, desc, provider, is_complete, is_course) \
+            VALUES (?, 'Header Course', 'Testing', 'A course.', 'Provider', 0, 1)",
+            (user_id,)
+        )
+        db.commit()
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = user_id
+    return client
@@ -0,0 +1,13 @@
+"""The committed, purged Bootstrap must cover the templates (see assets.py)."""
+from assets import SAFELIST, purged_classes, template_classes
+
+
+def test_purged_bootstrap_covers_template_classes(app):
+    missing = (template_classes(app) | SAFELIST) - purged_classes(app)
+    assert not missing, f"Re-run `flask assets bootstrap` for {sorted(missing)}"
+
+
+def test_pages_use_local_bootstrap(client):
+    page = client.get("/login").get_data(as_text=True)
+    assert "/static/bootstrap.min.css" in page or "/assets/bootstrap." in page
+    assert "cdn.jsdelivr.net" not in page
@@ -0,0 +1,65 @@
+"""Cache-Control policy of each route (see helpers.cache_control)."""
+import pytest
+
+NO_STORE = {"no-cache", "no-store", "must-revalidate"}
+
+
+def directives(response):
+    return {directive.strip() for directive in response.headers["Cache-Control"].split(",")}
+
+
+@pytest.mark.parametrize("path", ["/login", "/register"])
+def test_public_forms_are_kept_privately(client, path):
+    response = client.get(path)
+    assert response.status_code == 200
+    assert directives(response) == {"private", "max-age=600"}
+
+
+@pytest.mark.parametrize("store", ["sqlite", "signed"])
+@pytest.mark.parametrize("path", ["/login", "/register"])
+def test_public_forms_vary_with_the_session(app, user_client, monkeypatch, store, path):
+    from sessions import SignedSessionInterface, SQLiteSessionInterface, signing_keys
+
+    if store == "signed":
+        interface = SignedSessionInterface(SQLiteSessionInterface(), signing_keys(app))
+        monkeypatch.setattr(app, "session_interface", interface)
+
+    response = user_client.get(path)
+    assert directives(response) == {"private", "max-age=600"}
+    assert "cookie" in response.vary
+
+
+def test_add_form_is_kept_privately(user_client):
+    response = user_client.get("/add")
+    assert response.status_code == 200
+    assert directives(response) == {"private", "max-age=600"}
+
+
+def test_posted_form_is_not_cached(user_client):
+    response = user_client.post("/add", data={})
+    assert directives(response) == NO_STORE
+
+
+def test_listing_is_revalidated_by_etag(user_client):
+    response = user_client.get("/")
+    assert response.status_code == 200
+    assert directives(response) == {"private", "no-cache"}
+    assert response.headers["ETag"]
+
+    revalidated = user_client.get("/", headers={"If-None-Match": response.headers["ETag"]})
+    assert revalidated.status_code == 304
+
+
+@pytest.mark.parametrize("path", ["/update", "/export"])
+def test_pages_without_a_policy_are_not_stored(user_client, path):
+    response = user_client.get(path)
+    assert response.status_code == 200
+    assert directives(response) == NO_STORE
+    response.close()
+
+
+def test_static_files_are_cached_for_an_hour(client):
+    response = client.get("/static/style.css")
+    assert response.status_code == 200
+    assert directives(response) == {"public", "max-age=3600"}
+    response.close()
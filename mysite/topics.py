@@ -0,0 +1,123 @@
+"""
+Normalized topics.
+
+The comma separated `courses.topics` field is kept for display, and each
+topic in it is also stored once in `topics` under a normalized key and
+linked to its course through `course_topics`. The key groups spellings
+across users; each link, and each user's skill count, keeps the spelling
+the user wrote, and only that is shown to them.
+
+`user_skill_counts` holds each user's completed entries per topic. Triggers
+keep it up to date on every write to courses and course_topics.
+"""
+import click
+from flask.cli import AppGroup
+
+from database import get_db
+
+
+def topic_key(topic):
+    """Key two spellings of a topic share, ignoring case and spacing."""
+    return " ".join(topic.split()).casefold()
+
+
+def split_topics(text):
+    """Split a topics field into (key, label) pairs, dropping blanks and repeats."""
+    topics = {}
+    for part in text.split(","):
+        label = " ".join(part.split())
+        if label:
+            topics.setdefault(topic_key(label), label)
+    return list(topics.items())
+
+
+def link_topics(db, entries, new=False):
+    """
+    Link each (course_id, topics field) in `entries` to its topics.
+
+    Replaces any existing links for those courses, unless they are `new`.
+    Doesn't commit, so the caller's write and its topic links land in one
+    transaction.
+    """
+    entries = list(entries)
+    links = [(course_id, key, label) for course_id, text in entries for key, label in split_topics(text)]
+    labels = {}
+    for _, key, label in links:
+        labels.setdefault(key, label)
+
+    if not new:
+        db.executemany(
+            "DELETE FROM course_topics WHERE course_id = ?",
+            [(course_id,) for course_id, _ in entries]
+        )
+    db.executemany(
+        "INSERT INTO topics (key, label) VALUES (?, ?) ON CONFLICT (key) DO NOTHING",
+        labels.items()
+    )
+    db.executemany(
+        "INSERT INTO course_topics (course_id, topic_id, label) SELECT ?, id, ? FROM topics WHERE key = ?",
+        [(course_id, label, key) for course_id, key, label in links]
+    )
+
+
+def skill_counts(db, user_id):
+    """Completed entries per topic for `user_id`, most common first."""
+    return db.execute(
+        "SELECT user_skill_counts.label, user_skill_counts.count FROM user_skill_counts \
+        JOIN topics ON topics.id = user_skill_counts.topic_id \
+        WHERE user_skill_counts.user_id = ? \
+        ORDER BY user_skill_counts.count DESC, topics.key",
+        (user_id,)
+    ).fetchall()
+
+
+# user_skill_counts as recomputed from scratch
+RECOUNT = (
+    "SELECT courses.user_id, course_topics.topic_id, COUNT(*), MIN(course_topics.label) FROM courses \
+    JOIN course_topics ON course_topics.course_id = courses.id \
+    WHERE courses.is_complete = 2 \
+    GROUP BY courses.user_id, course_topics.topic_id"
+)
+
+
+def check_skill_counts(db):
+    """Return the (user_id, topic_id) pairs whose maintained count is wrong."""
+    expected = {(user_id, topic_id): count for user_id, topic_id, count, _ in db.execute(RECOUNT)}
+    actual = {
+        (user_id, topic_id): count
+        for user_id, topic_id, count in db.execute("SELECT user_id, topic_id, count FROM user_skill_counts")
+    }
+    return sorted(key for key in expected.keys() | actual.keys() if expected.get(key) != actual.get(key))
+
+
+def rebuild_skill_counts(db):
+    """Recompute user_skill_counts from course_topics. Doesn't commit."""
+    db.execute("DELETE FROM user_skill_counts")
+    db.execute(f"INSERT INTO user_skill_counts (user_id, topic_id, count, label) {RECOUNT}")
+
+
+skills_cli = AppGroup("skills", help="Maintain the per-user skill counts.")
+
+
+@skills_cli.command("check")
+def check_command():
+    """Compare the maintained skill counts with a full recount."""
+    wrong = check_skill_counts(get_db())
+    for user_id, topic_id in wrong:
+        click.echo(f"user {user_id} topic {topic_id} is out of date")
+    click.echo(f"{len(wrong)} skill counts out of date.")
+    if wrong:
+        raise SystemExit(1)
+
+
+@skills_cli.command("rebuild")
+def rebuild_command():
+    """Recompute every skill count from scratch."""
+    db = get_db()
+    rebuild_skill_counts(db)
+    db.commit()
+    click.echo("Skill counts rebuilt.")
+
+
+def init_topics(app):
+    app.cli.add_command(skills_cli)
@@ -0,0 +1,291 @@
+"""
+Export and import of a user's courses and modules as CSV, a JSON array or
+NDJSON.
+
+Exports are generated while they are sent: rows are fetched from the
+cursor a batch at a time and each batch is written out before the next is
+read, so memory use doesn't grow with the number of entries.
+
+Imports are read and validated a row at a time and inserted in batches
+with executemany, all in one transaction: either every row is imported, or
+none are and each bad row is reported.
+"""
+import csv
+import io
+import json
+import time
+
+import click
+from flask.cli import AppGroup
+
+from database import get_db
+from search import bulk_indexing
+from topics import link_topics
+
+# Fields of an exported entry, in order
+FIELDS = ("name", "url", "topics", "desc", "provider", "is_complete", "is_course")
+
+# Media type and file extension of each export format
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "json": ("application/json", "json"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+}
+
+BATCH_SIZE = 500
+
+# Bad rows reported before an import stops checking for more
+MAX_ERRORS = 100
+
+JSON_DECODER = json.JSONDecoder()
+
+
+def _batches(db, user_id, batch_size):
+    cursor = db.execute(
+        f"SELECT {', '.join(FIELDS)} FROM courses WHERE user_id = ? ORDER BY id",
+        (user_id,)
+    )
+    while rows := cursor.fetchmany(batch_size):
+        yield [dict(zip(FIELDS, row), is_course=bool(row[-1])) for row in rows]
+
+
+def export_entries(db, user_id, format, batch_size=BATCH_SIZE):
+    """Generate `user_id`'s entries in `format`, one chunk of text per batch of rows."""
+    if format == "csv":
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, FIELDS)
+        writer.writeheader()
+        yield buffer.getvalue()
+        for batch in _batches(db, user_id, batch_size):
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(batch)
+            yield buffer.getvalue()
+
+    elif format == "json":
+        yield "["
+        separator = "\n"
+        for batch in _batches(db, user_id, batch_size):
+            yield separator + ",\n".join(json.dumps(entry) for entry in batch)
+            separator = ",\n"
+        yield "\n]\n"
+
+    elif format == "ndjson":
+        for batch in _batches(db, user_id, batch_size):
+            yield "".join(json.dumps(entry) + "\n" for entry in batch)
+
+    else:
+        raise ValueError(f"Unsupported export format: {format}")
+
+
+def _json_array(stream, chunk_size=64 * 1024):
+    """Yield the items of a JSON array from a text stream without loading all of it."""
+    buffer = ""
+    while not buffer:
+        more = stream.read(chunk_size)
+        if not more:
+            break
+        buffer = more.lstrip()
+    if not buffer.startswith("["):
+        raise ValueError("Expected a JSON array.")
+    buffer = buffer[1:]
+    expect_item = True
+    first = True
+
+    while True:
+        buffer = buffer.lstrip()
+        if not buffer:
+            more = stream.read(chunk_size)
+            if not more:
+                raise ValueError("JSON array isn't closed.")
+            buffer = more
+            continue
+        if buffer[0] == "]":
+            if expect_item and not first:
+                raise ValueError("Expected a JSON array item after the comma.")
+            return
+        if not expect_item:
+            if buffer[0] != ",":
+                raise ValueError("Expected a comma between JSON array items.")
+            buffer = buffer[1:]
+            expect_item = True
+            continue
+
+        try:
+            item, end = JSON_DECODER.raw_decode(buffer)
+        except json.JSONDecodeError:
+            # Most likely an item cut short by the end of the chunk
+            more = stream.read(chunk_size)
+            if not more:
+                raise
+            buffer += more
+            continue
+        if end == len(buffer):
+            # A number or literal might continue in the next chunk
+            more = stream.read(chunk_size)
+            if more:
+                buffer += more
+                continue
+        yield item
+        buffer = buffer[end:]
+        expect_item = first = False
+
+
+def read_entries(stream, format):
+    """
+    Yield (line or item number, entry) from a text stream in `format`.
+
+    Entries are dicts, except for JSON that isn't an object, which is
+    passed through for validate() to reject.
+    """
+    if format == "csv":
+        reader = csv.DictReader(stream)
+        for entry in reader:
+            yield reader.line_num, entry
+    elif format == "json":
+        yield from enumerate(_json_array(stream), start=1)
+    elif format == "ndjson":
+        for number, line in enumerate(stream, start=1):
+            if line.strip():
+                try:
+                    yield number, json.loads(line)
+                except json.JSONDecodeError as error:
+                    yield number, ValueError(f"Invalid JSON: {error.msg}.")
+    else:
+        raise ValueError(f"Unsupported import format: {format}")
+
+
+def validate(entry):
+    """
+    Check an imported entry as /add would, returning the values of FIELDS.
+
+    Raises ValueError describing the first problem found.
+    """
+    if isinstance(entry, ValueError):
+        raise entry
+    if not isinstance(entry, dict):
+        raise ValueError("Each entry must be an object.")
+
+    values = {}
+    for field in ("name", "topics", "desc", "provider"):
+        value = entry.get(field)
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError(f"The {field} field is missing or empty.")
+        values[field] = value
+
+    url = entry.get("url")
+    if url is not None and not isinstance(url, str):
+        raise ValueError("The url field must be text.")
+    values["url"] = url or None
+
+    is_complete = str(entry.get("is_complete", "")).strip()
+    if is_complete not in ("0", "1", "2"):
+        raise ValueError("The is_complete field must be 0, 1 or 2.")
+    values["is_complete"] = int(is_complete)
+
+    is_course = entry.get("is_course")
+    if isinstance(is_course, str):
+        is_course = {"true": True, "1": True, "false": False, "0": False}.get(is_course.strip().lower())
+    if is_course not in (True, False):
+        raise ValueError("The is_course field must be true or false.")
+    values["is_course"] = bool(is_course)
+
+    return tuple(values[field] for field in FIELDS)
+
+
+def import_entries(db, user_id, entries, batch_size=1000):
+    """
+    Import (number, entry) pairs from read_entries() for `user_id`.
+
+    Returns (imported, errors, seconds), errors being (number, message)
+    pairs. Rows are only committed if there were no errors.
+    """
+    started = time.perf_counter()
+    imported = 0
+    errors = []
+
+    db.commit()
+    # Take the write lock up front, so the names and ids read below can't
+    # change before the rows are inserted
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        names = {name for (name,) in db.execute("SELECT name FROM courses WHERE user_id = ?", (user_id,))}
+        next_id = db.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM courses").fetchone()[0]
+
+        with bulk_indexing(db, user_id, next_id):
+            batch = []
+            for number, entry in entries:
+                try:
+                    values = validate(entry)
+                except ValueError as error:
+                    errors.append((number, str(error)))
+                else:
+                    if values[0] in names:
+                        errors.append((number, f"You already have an entry named {values[0]!r}."))
+                    names.add(values[0])
+                    batch.append((next_id, user_id, *values))
+                    next_id += 1
+
+                if len(errors) >= MAX_ERRORS:
+                    break
+                if len(batch) >= batch_size:
+                    imported += _insert(db, batch, errors)
+                    batch = []
+            imported += _insert(db, batch, errors)
+
+        if errors:
+            db.rollback()
+            imported = 0
+        else:
+            db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+
+    return imported, errors, time.perf_counter() - started
+
+
+def _insert(db, batch, errors):
+    """Insert a batch of rows and link their topics, unless an import has already failed."""
+    if errors or not batch:
+        return 0
+    db.executemany(
+        f"INSERT INTO courses (id, user_id, {', '.join(FIELDS)}) VALUES ({', '.join('?' * (len(FIELDS) + 2))})",
+        batch
+    )
+    link_topics(db, [(row[0], row[2 + FIELDS.index("topics")]) for row in batch], new=True)
+    return len(batch)
+
+
+entries_cli = AppGroup("entries", help="Import users' courses and modules.")
+
+
+@entries_cli.command("import")
+@click.argument("username")
+@click.argument("file", type=click.File("r", encoding="utf-8-sig"))
+@click.option("--format", "format", type=click.Choice(list(FORMATS)), help="Defaults to the file's extension.")
+def import_command(username, file, format):
+    """Import FILE as USERNAME's entries, all or nothing."""
+    format = format or file.name.rsplit(".", 1)[-1].lower()
+    if format not in FORMATS:
+        raise click.UsageError("Pass --format, as the file's extension isn't csv, json or ndjson.")
+
+    db = get_db()
+    user = db.execute("SELECT id FROM users WHERE username = ?", (username,)).fetchone()
+    if user is None:
+        raise click.UsageError(f"No user named {username!r}.")
+
+    try:
+        imported, errors, seconds = import_entries(db, user[0], read_entries(file, format))
+    except (ValueError, csv.Error) as error:
+        raise click.ClickException(f"Couldn't read {file.name}: {error}")
+
+    for number, message in errors:
+        click.echo(f"{number}: {message}")
+    if errors:
+        raise click.ClickException(f"Nothing imported: {len(errors)} bad row(s){' (stopped early)' if len(errors) >= MAX_ERRORS else ''}.")
+    click.echo(f"Imported {imported} entries in {seconds:.2f}s ({imported / max(seconds, 1e-9):.0f} rows/s).")
+
+
+def init_transfer(app):
+    app.cli.add_command(entries_cli)